@@ -0,0 +1,135 @@
+import json
+
+from utils.utils_cache import parse_address
+
+BRANCH_KINDS = ("jump", "call", "skip", "computed", "branch")
+
+
+def classify(address, opcode, response):
+    """
+    Return the outgoing edges of one decoded instruction as (target, kind) pairs, where kind is one of
+    fallthrough, jump, call, skip, computed (Bnnn, target is the base address) or branch (unknown opcodes).
+    """
+    edges = []
+    family = opcode >> 12
+
+    if "block" in response:
+        target = parse_address(response["block"])
+        if "block_end" in response:
+            kind = "computed" if family == 0xB else "jump" if family == 0x1 else "branch"
+        else:
+            kind = "call" if family == 0x2 else "skip" if target == address + 4 else "branch"
+        edges.append((target, kind))
+
+    if "block_end" not in response:
+        edges.append((address + 2, "fallthrough"))
+
+    return edges
+
+
+class BasicBlock:
+    def __init__(self, start):
+        self.start = start
+        self.instructions = []
+        self.successors = []
+
+    @property
+    def end(self):
+        return self.instructions[-1] if self.instructions else self.start
+
+    def to_dict(self):
+        return {
+            "start": self.start,
+            "end": self.end,
+            "instructions": self.instructions,
+            "successors": [{"target": target, "kind": kind} for target, kind in self.successors],
+        }
+
+
+class ControlFlowGraph:
+
+    def __init__(self, entry=0x200):
+        self.entry = entry
+        self.blocks = {}
+        self.markers = {}
+
+    @classmethod
+    def from_disassembler(cls, disassembler, entry=0x200):
+        graph = cls(entry)
+
+        edges = {}
+        for address, (opcode_hex, response) in disassembler.responses.items():
+            opcode = int(opcode_hex, 16)
+            edges[address] = classify(address, opcode, response)
+            if "marker" in response:
+                marker = parse_address(response["marker"])
+                if not any(target == marker and kind != "fallthrough" for target, kind in edges[address]):
+                    graph.markers.setdefault(marker, []).append(address)
+
+        leaders = {entry} & edges.keys()
+        for address, outgoing in edges.items():
+            if any(kind in BRANCH_KINDS for _, kind in outgoing):
+                leaders.update(target for target, _ in outgoing if target in edges)
+
+        for leader in sorted(leaders):
+            block = BasicBlock(leader)
+            address = leader
+            while True:
+                block.instructions.append(address)
+                outgoing = edges[address]
+                next_address = address + 2
+                falls_through = outgoing == [(next_address, "fallthrough")]
+                if not falls_through or next_address not in edges or next_address in leaders:
+                    block.successors = outgoing
+                    break
+                address = next_address
+            graph.blocks[leader] = block
+
+        return graph
+
+    def to_dict(self):
+        return {
+            "entry": self.entry,
+            "blocks": [block.to_dict() for block in self.blocks.values()],
+            "markers": [{"address": marker, "referenced_by": sources}
+                        for marker, sources in sorted(self.markers.items())],
+        }
+
+    def to_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        graph = cls(data["entry"])
+        for block_data in data["blocks"]:
+            block = BasicBlock(block_data["start"])
+            block.instructions = block_data["instructions"]
+            block.successors = [(edge["target"], edge["kind"]) for edge in block_data["successors"]]
+            graph.blocks[block.start] = block
+        graph.markers = {marker["address"]: marker["referenced_by"] for marker in data["markers"]}
+        return graph
+
+    def to_dot(self, path, instructions=None):
+        styles = {
+            "fallthrough": "solid",
+            "jump": "bold",
+            "call": "dashed",
+            "skip": "dotted",
+            "computed": "bold,dashed",
+            "branch": "dotted",
+        }
+        lines = ["digraph chip8 {", '    node [shape=box, fontname="monospace"];']
+        for start, block in self.blocks.items():
+            label = f"{start:03X}-{block.end:03X}"
+            if instructions is not None:
+                label += "\\l" + "\\l".join(f"{address:03X}: {instructions[address]}".replace('"', '\\"')
+                                          for address in block.instructions) + "\\l"
+            lines.append(f'    b{start:03X} [label="{label}"];')
+            for target, kind in block.successors:
+                lines.append(f'    b{start:03X} -> b{target:03X} [label="{kind}", style="{styles[kind]}"];')
+        lines.append("}")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
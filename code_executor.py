@@ -4,14 +4,24 @@ import random
 
 class CodeExecutor:
 
-    def __init__(self, cpu):
+    # Shared by every executor so compiled instructions survive ROM reloads
+    compiled_code = {}
+
+    def __init__(self, cpu, rng=random, verbose=True):
         self.cpu = cpu
+        self.rng = rng
+        self.verbose = verbose
+        self.error_count = 0
 
     def execute_code(self, code):
-        tree = ast.parse(code, mode='exec')
+        compiled = self.compiled_code.get(code)
+        if compiled is None:
+            tree = ast.parse(code, mode='exec')
+            compiled = compile(tree, filename="<ast>", mode="exec")
+            self.compiled_code[code] = compiled
 
         exec_env = {
-            'random': random,
+            'random': self.rng,
             'self': self.cpu,
             'PC': self.cpu.PC,
             'I': self.cpu.I,
@@ -28,9 +38,11 @@ class CodeExecutor:
         }
 
         try:
-            exec(compile(tree, filename="<ast>", mode="exec"), exec_env)
+            exec(compiled, exec_env)
         except Exception as e:
-            print(f"Error executing code: {e}")
+            self.error_count += 1
+            if self.verbose:
+                print(f"Error executing code: {e}")
 
 
         self.cpu.PC = exec_env['PC']
@@ -1,5 +1,4 @@
 from code_executor import CodeExecutor
-from utils.utils_emulator import KEY_MAP
 
 
 class CPU:
@@ -28,6 +27,9 @@ class CPU:
         return instruction
 
     def keypress(self, key):
+        # Imported here so that the CPU can run headless, without pygame, e.g. to validate decodes
+        from utils.utils_emulator import KEY_MAP
+
         for pygame_key, chip8_key in KEY_MAP.items():
             if key == pygame_key:
                 self.V[self.keypress_register] = chip8_key
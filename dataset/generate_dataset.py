@@ -1,9 +1,11 @@
+import argparse
 import json
 import random
 
 from tqdm import tqdm
 
 from dataset.opcode_messages import get_opcode_messages
+from utils.utils_prompts import PROMPT_VERSION, get_prompt_format
 
 SEED = 42
 
@@ -107,7 +109,23 @@ def generate_sampled_opcodes():
     return opcodes, labels, params
 
 
-def main():
+def convert_messages(entry, prompt_format):
+    """
+    Rewrite a sample generated in the v1 format into the prompt and response format of another prompt version.
+    """
+    user, assistant = entry["messages"]
+    (address, opcode_hex), = get_prompt_format("v1").items(user["content"])
+    response = prompt_format.encode(json.loads(assistant["content"]))
+    return {
+        "messages": [
+            {"role": "user", "content": prompt_format.prompt(address, opcode_hex)},
+            {"role": "assistant", "content": json.dumps(response)},
+        ]
+    }
+
+
+def main(prompt_version=PROMPT_VERSION):
+    prompt_format = get_prompt_format(prompt_version)
     opcodes, labels, params = generate_sampled_opcodes()
 
     dataset = []
@@ -115,6 +133,8 @@ def main():
     for _ in tqdm(range(20), desc="Generating dataset"):
         for opcode, label, param in zip(opcodes, labels, params):
             messages = get_opcode_messages(f"0x{opcode:0{4}x}", param)
+            if prompt_format.version != "v1":
+                messages = convert_messages(messages, prompt_format)
             dataset.append(messages)
 
     random.shuffle(dataset)
@@ -123,11 +143,13 @@ def main():
     df_train = dataset[:train_size]
     df_eval = dataset[train_size:]
 
-    with open("chipstral_train.jsonl", "w") as train_file:
+    prefix = "chipstral" if prompt_format.version == "v1" else f"chipstral_{prompt_format.version}"
+
+    with open(f"{prefix}_train.jsonl", "w") as train_file:
         for entry in df_train:
             train_file.write(json.dumps(entry) + "\n")
 
-    with open("chipstral_eval.jsonl", "w") as eval_file:
+    with open(f"{prefix}_eval.jsonl", "w") as eval_file:
         for entry in df_eval:
             eval_file.write(json.dumps(entry) + "\n")
 
@@ -135,4 +157,9 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompt-version", default=PROMPT_VERSION,
+                        help="Prompt and response format of the samples, e.g. v2 for the compact format")
+    args = parser.parse_args()
+
+    main(args.prompt_version)
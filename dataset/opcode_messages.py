@@ -1,7 +1,7 @@
 import json
 import random
 
-from utils.utils_llm import INSTRUCTION_PROMPT, USER_PROMPT
+from utils.utils_prompts import INSTRUCTION_PROMPT, USER_PROMPT
 
 
 def get_opcode_messages(opcode, params):
@@ -0,0 +1,243 @@
+import threading
+
+
+class Breakpoint:
+
+    def __init__(self, address=None, condition=None):
+        self.address = address
+        self.condition = condition
+        self.code = compile(condition, "<breakpoint>", "eval") if condition else None
+        self.hits = 0
+        self.error = None
+
+    def matches(self, cpu):
+        if self.code is None:
+            return True
+        env = {
+            'PC': cpu.PC,
+            'I': cpu.I,
+            'DT': cpu.DT,
+            'ST': cpu.ST,
+            'V': cpu.V,
+            'memory': cpu.memory,
+            'stack': cpu.stack,
+            'keys': cpu.keys,
+        }
+        try:
+            return bool(eval(self.code, env))
+        except Exception as e:
+            # A condition that cannot be evaluated pauses rather than stopping the emulator
+            self.error = f"{type(e).__name__}: {e}"
+            return True
+
+    def __str__(self):
+        where = f"{self.address:03X}" if self.address is not None else "any"
+        return f"{where} if {self.condition}" if self.condition else where
+
+
+class Debugger:
+    """
+    Breakpoints, memory watches and stepping for a running CPU.
+
+    The debugger only takes over `cpu.fetch_execute_cycle` while it has something to check, so with no
+    breakpoints, watches or pending steps the CPU dispatches through its own class method as usual. Commands
+    arrive on another thread, so the breakpoints, watches and pause and step state are only changed or read under
+    `lock`.
+    """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.breakpoints = {}
+        self.conditions = []
+        self.watches = {}
+        self.paused = False
+        self.steps = 0
+        self.step_over_target = None
+        self.step_over_depth = 0
+        self.stop_reason = None
+        self.resume_address = None
+        self.lock = threading.RLock()
+
+    def add_breakpoint(self, address, condition=None):
+        breakpoint = Breakpoint(address, condition)
+        with self.lock:
+            self.breakpoints.setdefault(address, []).append(breakpoint)
+            self.update_dispatch()
+        return breakpoint
+
+    def add_condition(self, condition):
+        breakpoint = Breakpoint(condition=condition)
+        with self.lock:
+            self.conditions.append(breakpoint)
+            self.update_dispatch()
+        return breakpoint
+
+    def add_watch(self, address):
+        with self.lock:
+            self.watches[address] = self.cpu.memory[address]
+            self.update_dispatch()
+
+    def remove(self, address):
+        with self.lock:
+            self.breakpoints.pop(address, None)
+            self.watches.pop(address, None)
+            self.update_dispatch()
+
+    def clear(self):
+        with self.lock:
+            self.breakpoints.clear()
+            self.conditions.clear()
+            self.watches.clear()
+            self.update_dispatch()
+
+    def pause(self, reason="paused"):
+        with self.lock:
+            self.paused = True
+            self.stop_reason = reason
+            self.step_over_target = None
+            self.update_dispatch()
+
+    def resume(self):
+        with self.lock:
+            self.resume_address = self.cpu.PC
+            self.paused = False
+            self.stop_reason = None
+            self.update_dispatch()
+
+    def step(self, count=1):
+        with self.lock:
+            if not self.paused:
+                self.pause()
+            self.steps += count
+
+    def step_over(self):
+        with self.lock:
+            if not self.paused:
+                self.pause()
+            instruction = self.cpu.instructions.get(self.cpu.PC)
+            if instruction is None or not instruction.startswith("stack.append"):
+                self.step()
+                return
+            self.step_over_target = self.cpu.PC + 2
+            self.step_over_depth = len(self.cpu.stack)
+            self.resume()
+
+    def is_active(self):
+        return bool(self.paused or self.breakpoints or self.conditions or self.watches
+                    or self.step_over_target is not None)
+
+    def update_dispatch(self):
+        if self.is_active():
+            self.cpu.fetch_execute_cycle = self.fetch_execute_cycle
+        else:
+            self.cpu.__dict__.pop('fetch_execute_cycle', None)
+
+    def fetch_execute_cycle(self):
+        cpu = self.cpu
+
+        if self.paused:
+            with self.lock:
+                stepping = self.steps > 0
+                if stepping:
+                    self.steps -= 1
+            if stepping:
+                self.execute()
+            return
+
+        pc = cpu.PC
+        if pc != self.resume_address:
+            with self.lock:
+                reason = self.check_breakpoints(pc)
+            if reason is not None:
+                self.pause(reason)
+                return
+        self.resume_address = None
+
+        self.execute()
+
+    def check_breakpoints(self, pc):
+        cpu = self.cpu
+
+        if self.step_over_target == pc and len(cpu.stack) <= self.step_over_depth:
+            return f"stepped over to {pc:03X}"
+
+        for breakpoint in self.breakpoints.get(pc, ()):
+            if breakpoint.matches(cpu):
+                breakpoint.hits += 1
+                return self.failed(breakpoint) or f"breakpoint {breakpoint}"
+
+        for breakpoint in self.conditions:
+            if breakpoint.matches(cpu):
+                breakpoint.hits += 1
+                return self.failed(breakpoint) or f"condition {breakpoint.condition} at {pc:03X}"
+
+        return None
+
+    def failed(self, breakpoint):
+        if breakpoint.error is None:
+            return None
+        reason = f"condition {breakpoint.condition} failed at {self.cpu.PC:03X}: {breakpoint.error}"
+        breakpoint.error = None
+        return reason
+
+    def execute(self):
+        cpu = self.cpu
+        type(cpu).fetch_execute_cycle(cpu)
+
+        with self.lock:
+            for address, previous in self.watches.items():
+                value = cpu.memory[address]
+                if value != previous:
+                    self.watches[address] = value
+                    if not self.paused:
+                        self.pause(f"watch {address:03X}: {previous:02X} -> {value:02X}")
+
+    def command(self, line):
+        parts = line.split(maxsplit=1)
+        if not parts:
+            return None
+        name, argument = parts[0], parts[1] if len(parts) > 1 else ""
+
+        if name in ('b', 'break'):
+            address, _, condition = argument.partition(" if ")
+            breakpoint = self.add_breakpoint(int(address, 16), condition.strip() or None)
+            return f"Breakpoint set at {breakpoint}"
+        if name in ('cond', 'when'):
+            self.add_condition(argument)
+            return f"Condition set: {argument}"
+        if name in ('w', 'watch'):
+            self.add_watch(int(argument, 16))
+            return f"Watching {int(argument, 16):03X}"
+        if name in ('d', 'delete'):
+            if argument == 'all':
+                self.clear()
+            else:
+                self.remove(int(argument, 16))
+            return "Deleted"
+        if name in ('s', 'step'):
+            self.step(int(argument) if argument else 1)
+            return None
+        if name in ('n', 'next'):
+            self.step_over()
+            return None
+        if name in ('c', 'continue'):
+            self.resume()
+            return None
+        if name in ('p', 'pause'):
+            self.pause()
+            return None
+        return f"Unknown command: {name}"
+
+    def describe(self):
+        lines = [f"[bold blue]STATE[/bold blue]: {'paused' if self.paused else 'running'}"]
+        if self.stop_reason:
+            lines.append(f"[bold red]{self.stop_reason}[/bold red]")
+        with self.lock:
+            for breakpoints in self.breakpoints.values():
+                lines.extend(f"[bold blue]B[/bold blue] {breakpoint} ({breakpoint.hits})"
+                             for breakpoint in breakpoints)
+            lines.extend(f"[bold blue]C[/bold blue] {breakpoint.condition} ({breakpoint.hits})"
+                         for breakpoint in self.conditions)
+            lines.extend(f"[bold blue]W[/bold blue] {address:03X} = {value:02X}"
+                         for address, value in self.watches.items())
+        return lines
@@ -1,23 +1,48 @@
-import json
+import asyncio
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from memory import Memory
-from utils.utils_llm import call_llm, USER_PROMPT, INSTRUCTION_PROMPT
+from utils import utils_llm
+from utils.utils_cache import parse_address
+from utils.utils_prompts import PROMPT_VERSION, get_prompt_format
+from utils.utils_rules import decode_with_rules
+from utils.utils_scheduler import ScheduledBackend
+
+REQUERY_TEMPERATURE = 0.7
+PARSE_ATTEMPTS = 3
 
 
 class Disassembler:
 
-    def __init__(self):
+    def __init__(self, llm_only=False, cache=None, batch_size=1, journal=None, backend=None,
+                 prompt_version=PROMPT_VERSION, templates=None, validator=None):
+        self.backend = backend or ScheduledBackend(utils_llm.backend)
+        self.prompts = get_prompt_format(prompt_version)
+        self.llm_only = llm_only
+        self.cache = cache
+        self.templates = templates
+        self.validator = validator
+        self.batch_size = batch_size
+        self.journal = journal
+        self.prefetched = {}
+        self.replay = {}
+        self.replay_journaled = True
         self.memory = Memory()
         self.rom_size = 0
         self.markers = []
         self.active_blocks = []
-        self.total_blocks = []
+        self.total_blocks = set()
         self.decoded_instructions = {}
+        self.responses = {}
         self.active_address = 0x200
         self.block_end = False
         self.disassembly_history = []
         self.llm_history = deque(maxlen=5)
+        self.llm_calls = 0
+        self.rule_decodes = 0
+        self.replayed = 0
+        self.requeried = 0
 
     def load_rom(self, rom_path):
         memory = Memory()
@@ -29,6 +54,11 @@ class Disassembler:
         self.memory = memory
 
     def decode(self, address=0x200):
+        self.active_blocks.append(address)
+        while self.active_blocks:
+            self.decode_block(self.active_blocks.pop())
+
+    def decode_block(self, address):
         self.block_end = False
         self.active_address = address
 
@@ -38,35 +68,351 @@ class Disassembler:
                 self.block_end = True
                 break
 
-            if self.active_address - 0x200 + 1 > self.rom_size:
+            if not self.in_rom(self.active_address):
                 self.block_end = True
                 break
 
-            opcode = self.memory.read_byte(self.active_address) << 8 | self.memory.read_byte(self.active_address + 1)
-            opcode_hex = f'0x{opcode:04x}'
+            json_response = self.decode_instruction(self.active_address)
 
-            prompt = USER_PROMPT.format(INSTRUCTION_PROMPT, self.active_address, opcode_hex)
-            response = call_llm(prompt)
+            if "block_end" in json_response:
+                self.block_end = True
 
-            json_response = json.loads(response.choices[0].message.content)
+            self.active_address += 2
 
-            self.decoded_instructions[self.active_address] = json_response["decoded_instruction"]
+    async def decode_async(self, address=0x200, concurrency=8, lookahead=4):
+        """
+        Same walk as `decode`, but blocks are followed concurrently and the next `lookahead` fall-through
+        addresses are requested ahead of the current one, with at most `concurrency` LLM calls in flight.
+        Results are committed in walk order, so the disassembly is identical to the sequential one.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        # The default executor has at most min(32, CPUs + 4) threads, fewer than `concurrency` on small machines
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        queries = {}
+        walks = []
 
-            if "marker" in json_response:
-                self.add_marker(json_response["marker"])
-            if "block" in json_response:
-                self.add_block(json_response["block"])
-            if "block_end" in json_response:
-                self.block_end = True
+        def request(next_address):
+            if next_address not in queries and next_address not in self.decoded_instructions \
+                    and self.in_rom(next_address):
+                queries[next_address] = asyncio.ensure_future(self.query_async(next_address, semaphore, executor))
+
+        async def walk(start):
+            active_address = start
+            while active_address not in self.decoded_instructions and self.in_rom(active_address):
+                for offset in range(0, (lookahead + 1) * 2, 2):
+                    request(active_address + offset)
+
+                opcode_hex, prompt, json_response = await queries[active_address]
+                if active_address not in self.decoded_instructions:
+                    self.active_address = active_address
+                    self.apply(active_address, opcode_hex, prompt, json_response)
+
+                while self.active_blocks:
+                    walks.append(asyncio.ensure_future(walk(self.active_blocks.pop())))
+
+                if "block_end" in json_response:
+                    break
+                active_address += 2
+
+        walks.append(asyncio.ensure_future(walk(address)))
+        try:
+            index = 0
+            while index < len(walks):
+                await walks[index]
+                index += 1
+        finally:
+            pending = [task for task in list(queries.values()) + walks if not task.done()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*queries.values(), *walks, return_exceptions=True)
+            executor.shutdown(wait=False)
+
+    def in_rom(self, address):
+        return 0x200 <= address and address - 0x200 + 1 <= self.rom_size
+
+    def read_opcode(self, address):
+        opcode = self.memory.read_byte(address) << 8 | self.memory.read_byte(address + 1)
+        return f'0x{opcode:04x}'
+
+    def decode_instruction(self, address):
+        opcode_hex, prompt, json_response = self.query(address)
+        self.apply(address, opcode_hex, prompt, json_response)
+        return json_response
+
+    def query(self, address):
+        opcode_hex, prompt, json_response = self.lookup(address)
+        if json_response is None and self.batch_size > 1:
+            self.prefetch(address)
+            json_response = self.prefetched.get(address)
+        if json_response is None:
+            json_response = self.request(address, opcode_hex, prompt)
+        return opcode_hex, prompt, json_response
+
+    def request(self, address, opcode_hex, prompt):
+        """
+        Decode one instruction with the LLM, asking again at a higher temperature when the answer is malformed.
+        """
+        for attempt in range(PARSE_ATTEMPTS):
+            json_response = self.receive(address, opcode_hex,
+                                         self.backend.chat(prompt, REQUERY_TEMPERATURE if attempt else 0))
+            if json_response is not None:
+                return json_response
+        raise self.malformed(address, opcode_hex)
+
+    def prefetch(self, address):
+        """
+        Decode the instruction at `address` in one batch with those following it that `lookup` cannot answer, up to
+        the end of the block: an address already decoded or an instruction the rule table knows ends a block.
+        """
+        items = []
+        while len(items) < self.batch_size and self.in_rom(address) and address not in self.decoded_instructions:
+            opcode_hex = self.read_opcode(address)
+            if address not in self.prefetched and not self.known(address, opcode_hex):
+                items.append((address, opcode_hex))
+            reference = decode_with_rules(address, opcode_hex)
+            if reference is not None and "block_end" in reference:
+                break
+            address += 2
+        if items:
+            self.query_batch(items)
+
+    def query_batch(self, items):
+        """
+        Decode several (address, opcode) pairs with one request. A malformed response is split in halves and
+        retried; malformed elements of an otherwise valid response are retried one by one.
+        """
+        prompt = self.prompts.batch_prompt(items)
+        response = self.backend.chat(prompt)
+        self.llm_calls += 1
+
+        try:
+            decodes = self.prompts.parse_batch(response.content)
+        except (ValueError, KeyError, TypeError):
+            decodes = None
+
+        if not isinstance(decodes, list) or len(decodes) != len(items):
+            if len(items) > 1:
+                middle = len(items) // 2
+                self.query_batch(items[:middle])
+                self.query_batch(items[middle:])
+                return
+            decodes = [None]
+
+        for (address, opcode_hex), json_response in zip(items, decodes):
+            if not isinstance(json_response, dict) or not isinstance(json_response.get("decoded_instruction"), str):
+                json_response = self.request(address, opcode_hex, self.prompts.prompt(address, opcode_hex))
+            else:
+                self.learn(address, opcode_hex, json_response)
+            self.prefetched[address] = json_response
+
+    async def query_async(self, address, semaphore, executor=None):
+        opcode_hex, prompt, json_response = self.lookup(address)
+        if json_response is None:
+            loop = asyncio.get_running_loop()
+            for attempt in range(PARSE_ATTEMPTS):
+                async with semaphore:
+                    response = await loop.run_in_executor(executor, self.backend.chat, prompt,
+                                                          REQUERY_TEMPERATURE if attempt else 0)
+                json_response = self.receive(address, opcode_hex, response)
+                if json_response is not None:
+                    break
+            else:
+                raise self.malformed(address, opcode_hex)
+        return opcode_hex, prompt, json_response
+
+    def lookup(self, address):
+        opcode_hex = self.read_opcode(address)
+
+        if not self.llm_only:
+            json_response = decode_with_rules(address, opcode_hex)
+            if json_response is not None:
+                return opcode_hex, None, json_response
 
+        prompt = self.prompts.prompt(address, opcode_hex)
+
+        replayed = self.replay.get(address)
+        if replayed is not None and replayed[0] == opcode_hex:
+            return opcode_hex, prompt, replayed[1]
+
+        if address in self.prefetched:
+            return opcode_hex, prompt, self.prefetched[address]
+
+        if self.cache is not None:
+            json_response = self.cache.get(self.backend.model, self.prompts.version, opcode_hex, address)
+            if json_response is not None:
+                return opcode_hex, prompt, json_response
+
+        if self.templates is not None:
+            json_response = self.templates.lookup(address, opcode_hex)
+            if json_response is not None:
+                return opcode_hex, prompt, json_response
+
+        return opcode_hex, prompt, None
+
+    def known(self, address, opcode_hex):
+        """
+        Whether `lookup` would answer without the LLM. Unlike `lookup`, it counts no cache hit or template decode.
+        """
+        if not self.llm_only and decode_with_rules(address, opcode_hex) is not None:
+            return True
+        replayed = self.replay.get(address)
+        if replayed is not None and replayed[0] == opcode_hex:
+            return True
+        if self.cache is not None and self.cache.contains(self.backend.model, self.prompts.version, opcode_hex):
+            return True
+        return self.templates is not None and self.templates.covers(address, opcode_hex)
+
+    def receive(self, address, opcode_hex, response):
+        """
+        Parse an LLM answer and learn from it. Returns None if it is malformed or has no decoded instruction.
+        """
+        self.llm_calls += 1
+
+        try:
+            json_response = self.prompts.parse(response.content)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+        if not isinstance(json_response, dict) or not isinstance(json_response.get("decoded_instruction"), str):
+            return None
+        self.learn(address, opcode_hex, json_response)
+        return json_response
+
+    def malformed(self, address, opcode_hex):
+        return utils_llm.LLMError(f"no valid decode of {opcode_hex} at {address:#05x} after {PARSE_ATTEMPTS} "
+                                  f"attempts")
+
+    def accept(self, prompt, content):
+        """
+        Whether an LLM answer to `prompt` can be used: it parses, has a decode for every instruction asked for and,
+        with a validator, every decode passes validation. Used by a `CascadeBackend` to decide when to escalate.
+        """
+        items = self.prompts.items(prompt)
+        try:
+            decodes = self.prompts.parse_batch(content) if self.prompts.is_batch(prompt) \
+                else [self.prompts.parse(content)]
+        except (ValueError, KeyError, TypeError):
+            return False
+        if not isinstance(decodes, list) or len(decodes) != len(items):
+            return False
+        for (address, opcode_hex), json_response in zip(items, decodes):
+            if not isinstance(json_response, dict) or not isinstance(json_response.get("decoded_instruction"), str):
+                return False
+            if self.validator is not None and self.validator.check(address, opcode_hex, json_response) is not None:
+                return False
+        return True
+
+    def learn(self, address, opcode_hex, json_response):
+        if self.cache is not None:
+            self.cache.put(self.backend.model, self.prompts.version, opcode_hex, address, json_response)
+        if self.templates is not None:
+            self.templates.learn(address, opcode_hex, json_response)
+
+    def apply(self, address, opcode_hex, prompt, json_response):
+        self.decoded_instructions[address] = json_response["decoded_instruction"]
+        self.responses[address] = (opcode_hex, json_response)
+
+        replayed = self.replay.get(address) == (opcode_hex, json_response)
+        if replayed:
+            self.replayed += 1
+        if self.journal is not None and not (replayed and self.replay_journaled):
+            self.journal.append(address, opcode_hex, json_response)
+
+        if "marker" in json_response:
+            self.add_marker(json_response["marker"])
+        if "block" in json_response:
+            self.add_block(json_response["block"])
+
+        if prompt is not None:
             self.llm_history.append((prompt, json_response))
-            self.disassembly_history.append(
-                (hex(self.active_address), opcode_hex, json_response['decoded_instruction']))
+            if self.validator is not None:
+                self.validator.submit(address, opcode_hex, json_response)
+        else:
+            self.rule_decodes += 1
+        self.disassembly_history.append(
+            (hex(address), opcode_hex, json_response['decoded_instruction']))
 
-            self.active_address += 2
+    def revalidate(self, attempts=3):
+        """
+        Wait for the validation of the decodes and re-query those that failed at a higher temperature, up to
+        `attempts` times each. Code reached through a corrected decode is walked as usual, and code only reached
+        through the decode it replaced is forgotten. Decodes that still fail are dropped from the cache, and returned
+        as {address: reason}.
+        """
+        failures = self.validator.failures()
+        for _ in range(attempts):
+            if not failures:
+                break
+            unparsed = {}
+            for address, (opcode_hex, _, reason) in sorted(failures.items()):
+                prompt = self.prompts.prompt(address, opcode_hex)
+                self.requeried += 1
+                try:
+                    json_response = self.receive(address, opcode_hex,
+                                                 self.backend.chat(prompt, REQUERY_TEMPERATURE))
+                except utils_llm.LLMError:
+                    json_response = None
+                if json_response is None:
+                    unparsed[address] = failures[address]
+                    continue
+                self.apply(address, opcode_hex, prompt, json_response)
+                if "block_end" not in json_response:
+                    self.active_blocks.append(address + 2)
+            self.prune()
+            while self.active_blocks:
+                self.decode_block(self.active_blocks.pop())
+            failures = {address: failure for address, failure in {**unparsed, **self.validator.failures()}.items()
+                        if address in self.decoded_instructions}
+
+        if self.cache is not None:
+            for opcode_hex, _, _ in failures.values():
+                self.cache.delete(self.backend.model, self.prompts.version, opcode_hex)
+        return {address: reason for address, (_, _, reason) in failures.items()}
+
+    def prune(self, start=0x200):
+        """
+        Forget the decodes that can no longer be reached from `start`, following fall-throughs and blocks as the walk
+        does, together with the blocks and markers they referenced. Blocks queued but not walked yet are kept.
+        """
+        reachable = set()
+        blocks = set(self.active_blocks)
+        markers = set()
+        pending = [start, *self.active_blocks]
+        while pending:
+            address = pending.pop()
+            while address in self.responses and address not in reachable:
+                reachable.add(address)
+                json_response = self.responses[address][1]
+                if "marker" in json_response:
+                    markers.add(parse_address(json_response["marker"]))
+                if "block" in json_response:
+                    blocks.add(parse_address(json_response["block"]))
+                    pending.append(parse_address(json_response["block"]))
+                if "block_end" in json_response:
+                    break
+                address += 2
 
-        if len(self.active_blocks) > 0:
-            self.decode(self.active_blocks.pop())
+        for address in self.decoded_instructions.keys() - reachable:
+            del self.decoded_instructions[address]
+            del self.responses[address]
+        self.total_blocks &= blocks
+        self.markers = [marker for marker in self.markers if marker in markers]
+
+    def resume(self, entries, journaled=True):
+        """
+        Reuse the decodes of an interrupted run, as read from its journal. The walk is replayed from the start
+        and journaled answers are used wherever the opcode at that address is unchanged. With `journaled` False
+        the entries come from a previous run rather than from the journal being appended to, and reused decodes
+        are written again.
+        """
+        self.replay = entries
+        self.replay_journaled = journaled
+
+    def changed_addresses(self, entries):
+        """
+        Return the addresses of journaled instructions whose opcode differs in the loaded ROM.
+        """
+        return sorted(address for address, (opcode_hex, _) in entries.items()
+                      if not self.in_rom(address) or self.read_opcode(address) != opcode_hex)
 
     def add_marker(self, marker):
         if isinstance(marker, str) and marker[:2] == '0x':
@@ -82,23 +428,22 @@ class Disassembler:
             block = int(block)
         if block not in self.total_blocks:
             self.active_blocks.append(block)
-            self.total_blocks.append(block)
+            self.total_blocks.add(block)
 
-    def get_disassembly(self):
+    def iter_disassembly(self):
+        """
+        Yield (address, line) for every line of the `.chs`, in address order.
+        """
         address = 0x200
-        disassembly = ""
-
-        while address < 0x200 + self.rom_size:
-            disassembly += "0x{:04x}".format(address)
+        end = 0x200 + self.rom_size
 
+        while address < end:
             if address in self.decoded_instructions:
-                line = f"\t{self.decoded_instructions[address]}\n"
+                yield address, f"0x{address:04x}\t{self.decoded_instructions[address]}\n"
                 address += 2
             else:
-                data = self.memory.read_byte(address)
-                line = f"\tDB 0x{data:02x}\n"
+                yield address, f"0x{address:04x}\tDB 0x{self.memory.read_byte(address):02x}\n"
                 address += 1
 
-            disassembly += line
-
-        return disassembly
+    def get_disassembly(self):
+        return "".join(line for _, line in self.iter_disassembly())
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from collections import deque
+
+from cpu import CPU
+from disassembler import Disassembler
+from utils.utils_cache import DecodeCache
+from utils.utils_disassembly import write_disassembly
+
+
+class JITCPU(CPU):
+    def __init__(self, memory, display):
+        super().__init__(memory, display)
+        self.jit = None
+
+    def fetch(self):
+        instruction = self.instructions.get(self.PC)
+        if instruction is None and self.jit is not None:
+            instruction = self.jit.resolve(self.PC)
+        self.PC += 2
+        return instruction
+
+
+class JITDisassembler:
+    """
+    Decodes a ROM while it runs. The CPU asks `resolve` for any address it reaches that has not been decoded
+    yet, and a background worker keeps walking the control flow ahead of it. The `.chs` is rewritten as
+    decodes come in.
+    """
+
+    def __init__(self, cpu, rom_path, output_path=None, persist_interval=1.0):
+        self.cpu = cpu
+        self.disassembler = Disassembler(cache=DecodeCache())
+        self.disassembler.load_rom(rom_path)
+        self.output_path = output_path or f"{os.path.splitext(rom_path)[0]}.chs"
+        self.persist_interval = persist_interval
+        self.lock = threading.Lock()
+        self.frontier = deque([0x200])
+        self.pending_writes = 0
+        self.last_persist = time.perf_counter()
+        self.done = threading.Event()
+        cpu.jit = self
+
+    def resolve(self, address):
+        if not self.disassembler.in_rom(address):
+            return None
+        if address not in self.disassembler.decoded_instructions:
+            json_response = self.decode(address)
+            if "block_end" not in json_response:
+                with self.lock:
+                    self.frontier.appendleft(address + 2)
+        return self.cpu.instructions.get(address)
+
+    def decode(self, address):
+        opcode_hex, prompt, json_response = self.disassembler.query(address)
+
+        with self.lock:
+            if address in self.disassembler.decoded_instructions:
+                return json_response
+            self.disassembler.apply(address, opcode_hex, prompt, json_response)
+            self.cpu.instructions[address] = json_response["decoded_instruction"]
+            while self.disassembler.active_blocks:
+                self.frontier.append(self.disassembler.active_blocks.pop())
+            self.pending_writes += 1
+
+        return json_response
+
+    def next_address(self):
+        with self.lock:
+            while self.frontier:
+                address = self.frontier.popleft()
+                if address not in self.disassembler.decoded_instructions and self.disassembler.in_rom(address):
+                    return address
+        return None
+
+    def run(self):
+        while True:
+            address = self.next_address()
+            if address is None:
+                break
+
+            json_response = self.decode(address)
+            if "block_end" not in json_response:
+                with self.lock:
+                    self.frontier.appendleft(address + 2)
+
+            if time.perf_counter() - self.last_persist >= self.persist_interval:
+                self.persist()
+
+        self.persist()
+        self.done.set()
+
+    def persist(self):
+        # Called from the worker and from the emulator thread on exit, the lock keeps their writes apart
+        with self.lock:
+            if self.pending_writes == 0:
+                return
+            write_disassembly(self.disassembler.iter_disassembly(), self.output_path)
+            self.pending_writes = 0
+            self.last_persist = time.perf_counter()
+
+    def start(self):
+        worker_thread = threading.Thread(target=self.run, daemon=True)
+        worker_thread.start()
+        return worker_thread
+
+
+def load_rom(emulator, rom_path):
+    with open(rom_path, 'rb') as f:
+        rom_data = f.read()
+    for i, byte in enumerate(rom_data):
+        emulator.memory.write_byte(0x200 + i, byte)
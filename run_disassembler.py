@@ -1,35 +1,338 @@
+import argparse
+import asyncio
+import glob
+import json
 import os
-import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from cfg import ControlFlowGraph
 from disassembler import Disassembler
+from utils.utils_cache import DecodeCache
 from utils.utils_debug import start_disassembler_debug_thread
+from utils.utils_disassembly import write_disassembly
+from utils.utils_journal import DecodeJournal, read_journal
+from utils.utils_llm import BACKENDS, create_backend, estimate_cost
+from utils.utils_metrics import LLMMetrics
+from utils.utils_prompts import PROMPT_FORMATS, PROMPT_VERSION
+from utils.utils_scheduler import CascadeBackend, HedgedBackend, ScheduledBackend, SharedTokenBucket
+from utils.utils_store import DisassemblyStore, rom_hash
+from utils.utils_templates import TemplateCache
+from utils.utils_validation import DecodeValidator
+
+# Rate budgets shared by the batch worker processes, set by `init_worker`
+worker_buckets = (None, None)
+
+
+def main(assembly_path, debug_mode=False, llm_only=False, use_cache=True, concurrency=1, batch_size=1,
+         cfg_path=None, dot_path=None, resume=False, backend_name=None,
+         requests_per_minute=None, tokens_per_minute=None, max_retries=6,
+         hedge_percentile=None, hedge_budget=0.1, request_bucket=None, token_bucket=None, verbose=True,
+         summary_path=None, call_log_path=None, incremental=False, prompt_version=PROMPT_VERSION,
+         spot_check_interval=None, validate_attempts=None, cascade=None, use_store=True):
+    base_name = os.path.splitext(assembly_path)[0]
+    output_path = f"{base_name}.chs"
+    journal_path = f"{output_path}.journal"
+
+    call_log = open(call_log_path, "a") if call_log_path else None
+    metrics = LLMMetrics(call_log)
+    # Leave room in the scheduler for a hedge next to each request
+    max_concurrency = max(concurrency, 1) * (2 if hedge_percentile is not None else 1)
 
+    def scheduled_backend(name, model=None):
+        backend = ScheduledBackend(create_backend(name, model), requests_per_minute, tokens_per_minute,
+                                   max_concurrency=max_concurrency, max_retries=max_retries,
+                                   request_bucket=request_bucket, token_bucket=token_bucket, metrics=metrics)
+        if hedge_percentile is not None:
+            backend = HedgedBackend(backend, hedge_percentile, hedge_budget)
+        return backend
 
-def main(assembly_path, debug_mode=False):
-    disassembler = Disassembler()
+    if cascade:
+        backend = CascadeBackend([scheduled_backend(*parse_tier(tier, backend_name)) for tier in cascade])
+    else:
+        backend = scheduled_backend(backend_name)
+
+    store = DisassemblyStore() if use_store else None
+    digest = rom_hash(assembly_path)
+    if store is not None and not (debug_mode or cfg_path or dot_path):
+        stored = store.get(digest, backend.model, prompt_version, llm_only)
+        if stored is not None and (validate_attempts is None or stored.get("validated")):
+            store.emit(digest, backend.model, prompt_version, output_path, llm_only)
+            if call_log is not None:
+                call_log.close()
+            summary = {"rom": assembly_path, "rule_decodes": stored["rule_decodes"], "store_hit": True}
+            summary.update(metrics.summary(stored["decodes"]))
+            if summary_path:
+                with open(summary_path, "w") as f:
+                    json.dump(summary, f, indent=2)
+            if verbose:
+                print(f"Copied from the disassembly store, {stored['decodes']} instructions decoded on "
+                      f"{stored['created']}")
+            return summary
+
+    entries = read_journal(journal_path) if resume or incremental else {}
+    journal = DecodeJournal(journal_path, resume=resume)
+    cache = DecodeCache() if use_cache else None
+    templates = TemplateCache(spot_check_interval) if spot_check_interval is not None else None
+    validator = DecodeValidator() if validate_attempts is not None else None
+    disassembler = Disassembler(llm_only=llm_only, cache=cache, batch_size=batch_size, journal=journal,
+                                backend=backend, prompt_version=prompt_version, templates=templates,
+                                validator=validator)
+    if cascade:
+        backend.accept = disassembler.accept
     disassembler.load_rom(assembly_path)
+    disassembler.resume(entries, journaled=not incremental)
+    if incremental and verbose:
+        changed = disassembler.changed_addresses(entries)
+        print(f"{len(changed)} of {len(entries)} previously decoded instructions changed")
 
     if debug_mode:
         start_disassembler_debug_thread(disassembler)
 
-    disassembler.decode()
-    disassembly = disassembler.get_disassembly()
+    try:
+        if concurrency > 1:
+            asyncio.run(disassembler.decode_async(concurrency=concurrency))
+        else:
+            disassembler.decode()
+        invalid = disassembler.revalidate(validate_attempts) if validator is not None else {}
+    finally:
+        if validator is not None:
+            validator.close()
+        journal.close()
+        if call_log is not None:
+            call_log.close()
 
-    base_name = os.path.splitext(assembly_path)[0]
-    output_path = f"{base_name}.chs"
+    write_disassembly(disassembler.iter_disassembly(), output_path)
+    if store is not None:
+        store.put(digest, backend.model, prompt_version, output_path, {
+            "rom": os.path.basename(assembly_path),
+            "rom_size": disassembler.rom_size,
+            "decodes": len(disassembler.decoded_instructions),
+            "rule_decodes": disassembler.rule_decodes,
+            "llm_calls": disassembler.llm_calls,
+            "validated": validator is not None and not invalid,
+        }, llm_only)
 
-    with open(output_path, "w") as outfile:
-        outfile.write(disassembly)
+    if cfg_path or dot_path:
+        graph = ControlFlowGraph.from_disassembler(disassembler)
+        if cfg_path:
+            graph.to_json(cfg_path)
+        if dot_path:
+            graph.to_dot(dot_path, disassembler.decoded_instructions)
 
+    if cache is not None:
+        metrics.record_cache(cache.hits, cache.misses)
+        cache.close()
+    summary = {"rom": assembly_path, "rule_decodes": disassembler.rule_decodes}
+    if cascade:
+        summary["tiers"] = backend.tier_stats()
+    if validator is not None:
+        summary.update({"validated": validator.validated, "validation_failures": validator.failed,
+                        "requeried": disassembler.requeried,
+                        "invalid": [f"0x{address:04x}" for address in sorted(invalid)]})
+    summary.update(metrics.summary(len(disassembler.decoded_instructions)))
+    if summary_path:
+        with open(summary_path, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if verbose:
+        stats = backend.stats()
+        print(f"{disassembler.rule_decodes} instructions decoded by rules, {disassembler.llm_calls} by the LLM")
+        print(f"LLM latency p50 {summary['latency_p50_seconds']}s, p95 {summary['latency_p95_seconds']}s, "
+              f"p99 {summary['latency_p99_seconds']}s, {summary['prompt_tokens']} prompt + "
+              f"{summary['completion_tokens']} completion tokens, estimated cost ${summary['estimated_cost_usd']:.4f}")
+        print(f"LLM scheduler: {stats['retries']} retries, {stats['throttled']} throttled, {stats['errors']} errors, "
+              f"peak queue depth {stats['peak_queue_depth']}, {stats['budget_wait']}s waiting on the rate budget")
+        if hedge_percentile is not None:
+            print(f"Hedging: {stats['hedges']} duplicate requests after {stats['hedge_delay']}s, "
+                  f"{stats['hedge_wins']} answered first")
+        if cascade:
+            for tier in stats["tiers"]:
+                print(f"Tier {tier['model']}: {tier['requests']} requests, {tier['accepted']} accepted "
+                      f"({tier['hit_rate']:.0%}), {tier['rejected']} rejected, {tier['errors']} failed, "
+                      f"p50 {tier['latency_p50_seconds']}s, p95 {tier['latency_p95_seconds']}s, "
+                      f"{tier['prompt_tokens']} prompt + {tier['completion_tokens']} completion tokens")
+        if resume or incremental:
+            print(f"{disassembler.replayed} decodes reused from {journal_path}")
+        if templates is not None:
+            print(f"Operand templates: {templates.decodes} decodes, {templates.confirmations} confirmed, "
+                  f"{templates.spot_checks} spot checks, {templates.rejections} rejected")
+        if validator is not None:
+            print(f"Validation: {validator.validated} decodes checked, {validator.failed} failed, "
+                  f"{disassembler.requeried} re-queried, {len(invalid)} still invalid")
+            for address, reason in sorted(invalid.items()):
+                print(f"  0x{address:04x} {disassembler.decoded_instructions[address]!r}: {reason}")
+        if cache is not None:
+            print(f"Decode cache: {cache.hits} hits, {cache.misses} misses ({cache.hit_rate():.0%} hit rate)")
+
+    return summary
 
-if __name__ == "__main__":
 
-    if len(sys.argv) < 2:
-        print("Usage: python run_disassembler.py <path to ROM> [--debug]")
-        sys.exit(1)
+def parse_tier(spec, default_backend=None):
+    """
+    Read a cascade tier given as `backend:model`, or just `model` on the default backend.
+    """
+    name, _, model = spec.partition(":")
+    if name in BACKENDS:
+        return name, model or None
+    return default_backend, spec
+
+
+def find_roms(patterns):
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(glob.glob(os.path.join(pattern, "*.ch8"))))
+        else:
+            paths.extend(sorted(glob.glob(pattern)))
+    return list(dict.fromkeys(paths))
+
+
+def init_worker(request_bucket, token_bucket):
+    global worker_buckets
+    worker_buckets = (request_bucket, token_bucket)
+
+
+def disassemble_in_worker(assembly_path, options):
+    request_bucket, token_bucket = worker_buckets
+    return main(assembly_path, **options, request_bucket=request_bucket, token_bucket=token_bucket, verbose=False)
+
+
+def run_batch(paths, workers, options, requests_per_minute=None, tokens_per_minute=None, summary_path=None):
+    """
+    Disassemble several ROMs on a pool of processes. The workers share the decode cache (SQLite in WAL mode) and
+    one requests/tokens per minute budget.
+    """
+    request_bucket = SharedTokenBucket(requests_per_minute / 60 if requests_per_minute else None)
+    token_bucket = SharedTokenBucket(tokens_per_minute / 60 if tokens_per_minute else None)
+
+    start = time.perf_counter()
+    summaries = []
+    failures = 0
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(request_bucket, token_bucket)) as executor:
+        futures = {executor.submit(disassemble_in_worker, path, options): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"FAIL  {futures[future]}: {e!r}")
+                continue
+            summaries.append(summary)
+            print(f"OK    {summary['rom']}: {summary['decodes']} instructions, {summary['llm_calls']} LLM calls, "
+                  f"{summary['elapsed_seconds']:.1f}s, p95 {summary['latency_p95_seconds']}s")
+    elapsed = time.perf_counter() - start
+
+    decodes = sum(summary["decodes"] for summary in summaries)
+    llm_calls = sum(summary["llm_calls"] for summary in summaries)
+    prompt_tokens = sum(summary["prompt_tokens"] for summary in summaries)
+    completion_tokens = sum(summary["completion_tokens"] for summary in summaries)
+    total = {
+        "roms": len(summaries),
+        "failed": failures,
+        "workers": workers,
+        "elapsed_seconds": round(elapsed, 3),
+        "decodes": decodes,
+        "decodes_per_second": round(decodes / elapsed, 1),
+        "llm_calls": llm_calls,
+        "llm_calls_per_second": round(llm_calls / elapsed, 1),
+        "retries": sum(summary["retries"] for summary in summaries),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "estimated_cost_usd": round(estimate_cost(prompt_tokens, completion_tokens), 6),
+    }
+    if summary_path:
+        with open(summary_path, "w") as f:
+            json.dump({"total": total, "roms": sorted(summaries, key=lambda summary: summary["rom"])}, f, indent=2)
+
+    print(f"{len(summaries)} ROMs disassembled, {failures} failed, in {elapsed:.1f}s with {workers} workers")
+    print(f"{decodes} instructions ({total['decodes_per_second']}/s), {llm_calls} LLM calls "
+          f"({total['llm_calls_per_second']}/s), {total['retries']} retries")
+    print(f"{prompt_tokens} prompt + {completion_tokens} completion tokens, "
+          f"estimated cost ${total['estimated_cost_usd']:.4f}")
+    return failures == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python run_disassembler.py <path to ROM, directory or glob>... [--debug]")
+    parser.add_argument("assembly_paths", nargs="+")
+    parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--llm-only", action="store_true", help="Send every opcode to the LLM, bypassing the rules")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the decode cache")
+    parser.add_argument("--concurrency", type=int, default=1, help="Maximum number of LLM requests in flight")
+    parser.add_argument("--batch-size", type=int, default=1, help="Number of instructions decoded per LLM request")
+    parser.add_argument("--no-store", action="store_true",
+                        help="Do not copy a stored disassembly of the same ROM, model and prompt version, "
+                             "nor store this one")
+    parser.add_argument("--cfg", help="Write the control-flow graph as JSON to this path")
+    parser.add_argument("--dot", help="Write the control-flow graph as Graphviz DOT to this path")
+    parser.add_argument("--backend", choices=BACKENDS,
+                        help="LLM backend, defaults to the LLM_BACKEND environment variable or mistral")
+    parser.add_argument("--cascade", type=lambda value: value.split(","), metavar="TIER,TIER,...",
+                        help="Models tried in order, each as `model` or `backend:model`, escalating when an answer "
+                             "does not parse or, with --validate, fails validation")
+    parser.add_argument("--prompt-version", choices=list(PROMPT_FORMATS), default=PROMPT_VERSION,
+                        help="Prompt and response format the model was fine-tuned on")
+    parser.add_argument("--templates", nargs="?", type=int, const=20, metavar="SPOT_CHECK_INTERVAL",
+                        help="Decode opcodes by substituting operands in templates learned from LLM responses, "
+                             "sending one in SPOT_CHECK_INTERVAL (default 20) to the LLM to check them")
+    parser.add_argument("--validate", nargs="?", type=int, const=3, metavar="ATTEMPTS",
+                        help="Execute each LLM decode on random CPU states against the rule decoder's semantics "
+                             "and re-query failing decodes up to ATTEMPTS (default 3) times")
+    parser.add_argument("--rpm", type=int, help="Maximum LLM requests per minute")
+    parser.add_argument("--tpm", type=int, help="Maximum LLM tokens per minute")
+    parser.add_argument("--max-retries", type=int, default=6, help="Retries per LLM request before giving up")
+    parser.add_argument("--hedge-percentile", type=float,
+                        help="Duplicate LLM requests still running after this latency percentile, e.g. 95")
+    parser.add_argument("--hedge-budget", type=float, default=0.1,
+                        help="Maximum fraction of LLM requests that may be duplicated")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Worker processes when disassembling several ROMs")
+    parser.add_argument("--summary", help="Write the LLM latency, token and cost summary as JSON to this path")
+    parser.add_argument("--log-calls", help="Append one JSON line per LLM call to this path")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Reuse the decodes of the previous run for instructions whose bytes did not change")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run from the journal written next to the .chs")
+    args = parser.parse_args()
 
-    assembly_path = sys.argv[1]
-    debug_mode = '--debug' in sys.argv
+    paths = find_roms(args.assembly_paths)
+    if not paths:
+        parser.error("no ROM found")
+    if args.resume and args.incremental:
+        parser.error("--resume continues an interrupted run, --incremental starts a new one from the previous run")
 
-    print("Disassembling ROM...")
-    main(assembly_path, debug_mode)
-    print("Done!")
+    if len(paths) == 1 and os.path.isfile(args.assembly_paths[0]):
+        print("Disassembling ROM...")
+        main(paths[0], args.debug, args.llm_only, not args.no_cache, args.concurrency,
+             args.batch_size, args.cfg, args.dot, args.resume,
+             args.backend, args.rpm, args.tpm, args.max_retries,
+             args.hedge_percentile, args.hedge_budget, summary_path=args.summary, call_log_path=args.log_calls,
+             incremental=args.incremental, prompt_version=args.prompt_version,
+             spot_check_interval=args.templates, validate_attempts=args.validate, cascade=args.cascade,
+             use_store=not args.no_store)
+        print("Done!")
+    else:
+        if args.debug or args.cfg or args.dot:
+            parser.error("--debug, --cfg and --dot only apply to a single ROM")
+        print(f"Disassembling {len(paths)} ROMs...")
+        options = {
+            "llm_only": args.llm_only,
+            "use_cache": not args.no_cache,
+            "concurrency": args.concurrency,
+            "batch_size": args.batch_size,
+            "resume": args.resume,
+            "backend_name": args.backend,
+            "max_retries": args.max_retries,
+            "hedge_percentile": args.hedge_percentile,
+            "hedge_budget": args.hedge_budget,
+            "call_log_path": args.log_calls,
+            "incremental": args.incremental,
+            "prompt_version": args.prompt_version,
+            "spot_check_interval": args.templates,
+            "validate_attempts": args.validate,
+            "cascade": args.cascade,
+            "use_store": not args.no_store,
+        }
+        if not run_batch(paths, min(args.workers, len(paths)), options, args.rpm, args.tpm, args.summary):
+            raise SystemExit(1)
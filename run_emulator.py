@@ -1,90 +1,150 @@
+import argparse
+import time
+
 import pygame
 import sys
 
 from cpu import CPU
+from debugger import Debugger
 from emulator import Emulator
-from utils.utils_debug import start_emulator_debug_thread
+from jit import JITCPU, JITDisassembler, load_rom
+from utils.utils_debug import start_emulator_debug_thread, start_debugger_command_thread
 from utils.utils_emulator import load_disassembly, generate_beep_sound, KEY_MAP
+from utils.utils_metrics import EmulatorMetrics, start_metrics_threads
 
 SCREEN_WIDTH = 640
 SCREEN_HEIGHT = 320
 PIXEL_SIZE = 10
 
 
-def main(disassembly_path, debug_mode=False):
-
-    pygame.init()
-    pygame.mixer.init(frequency=44100, size=-16, channels=1, buffer=512)
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-    pygame.display.set_caption('Chipstral Emulator')
-    clock = pygame.time.Clock()
-
-    emulator = Emulator(cpu_type=CPU)
+class EmulatorWindow:
+    def __init__(self, caption='Chipstral Emulator'):
+        pygame.init()
+        pygame.mixer.init(frequency=44100, size=-16, channels=1, buffer=512)
+        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        pygame.display.set_caption(caption)
+        self.clock = pygame.time.Clock()
+        self.beep_sound = generate_beep_sound()
+        self.metrics = None
 
-    load_disassembly(emulator, disassembly_path)
-
-    beep_sound = generate_beep_sound()
-
-    if debug_mode:
-        start_emulator_debug_thread(emulator.cpu)
+        self.timer_event = pygame.USEREVENT + 1
+        pygame.time.set_timer(self.timer_event, 1000 // 60)  # Decrement at a rate of 60 Hz
 
-    timer_event = pygame.USEREVENT + 1
-    pygame.time.set_timer(timer_event, 1000 // 60)  # Decrement at a rate of 60 Hz
+        self.key_down_event = None
+        self.waiting_for_key_release = False
 
-    key_down_event = None
-    waiting_for_key_release = False
+    def step(self, emulator):
+        metrics = self.metrics
 
-    running = True
-    while running:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                running = False
-            elif event.type == timer_event:
+                return False
+            elif event.type == self.timer_event:
                 if emulator.cpu.DT > 0:
                     emulator.cpu.DT -= 1
                 if emulator.cpu.ST > 0:
                     if not pygame.mixer.get_busy():
-                        beep_sound.play(-1)
+                        self.beep_sound.play(-1)
                     emulator.cpu.ST -= 1
                 else:
                     if pygame.mixer.get_busy():
                         pygame.mixer.stop()
             elif event.type == pygame.KEYDOWN:
                 if event.key in KEY_MAP:
+                    if metrics:
+                        metrics.record_input()
                     emulator.cpu.keys[KEY_MAP[event.key]] = 1
                     if emulator.cpu.waiting_keypress:
-                        key_down_event = event.key
+                        self.key_down_event = event.key
                         emulator.cpu.keypress(event.key)
-                        waiting_for_key_release = True
+                        self.waiting_for_key_release = True
             elif event.type == pygame.KEYUP:
                 if event.key in KEY_MAP:
                     emulator.cpu.keys[KEY_MAP[event.key]] = 0
-                    if waiting_for_key_release and event.key == key_down_event:
-                        waiting_for_key_release = False
+                    if self.waiting_for_key_release and event.key == self.key_down_event:
+                        self.waiting_for_key_release = False
                         emulator.cpu.waiting_keypress = False
 
-        if not emulator.cpu.waiting_keypress and not waiting_for_key_release:
+        if metrics:
+            start = time.perf_counter()
+
+        if not emulator.cpu.waiting_keypress and not self.waiting_for_key_release:
             emulator.cycle()
+            if metrics:
+                metrics.cycles += 1
+
+        if metrics:
+            cpu_end = time.perf_counter()
+
+        self.render(emulator.display)
+
+        if metrics:
+            metrics.record_frame(start, cpu_end, time.perf_counter())
 
+        self.clock.tick(600)
+        return True
+
+    def render(self, display):
+        screen = self.screen
         screen.fill((0, 0, 0))
         for y in range(32):
             for x in range(64):
-                if emulator.display.pixels[y][x] == 1:
+                if display.pixels[y][x] == 1:
                     pygame.draw.rect(screen, (255, 255, 255), (x * PIXEL_SIZE, y * PIXEL_SIZE, PIXEL_SIZE, PIXEL_SIZE))
 
         pygame.display.flip()
-        clock.tick(600)
+
+    def reset_keys(self):
+        self.key_down_event = None
+        self.waiting_for_key_release = False
+        pygame.mixer.stop()
+
+
+def create_emulator(path):
+    if path.endswith('.ch8'):
+        emulator = Emulator(cpu_type=JITCPU)
+        load_rom(emulator, path)
+        jit = JITDisassembler(emulator.cpu, path)
+        jit.start()
+        return emulator, jit
+
+    emulator = Emulator(cpu_type=CPU)
+    load_disassembly(emulator, path)
+    return emulator, None
+
+
+def main(disassembly_path, debug_mode=False, metrics_port=None, metrics_log=None):
+    window = EmulatorWindow()
+
+    emulator, jit = create_emulator(disassembly_path)
+
+    if debug_mode:
+        debugger = Debugger(emulator.cpu)
+        start_emulator_debug_thread(emulator.cpu, debugger)
+        start_debugger_command_thread(debugger)
+
+    if metrics_port is not None or metrics_log is not None:
+        window.metrics = EmulatorMetrics(emulator.cpu)
+        start_metrics_threads(window.metrics, port=metrics_port, log_interval=metrics_log)
+
+    while window.step(emulator):
+        pass
+
+    if jit is not None:
+        jit.persist()
 
     pygame.quit()
     sys.exit()
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage: python emulator.py <path to disassembly> [--debug]")
-        sys.exit(1)
-
-    disassembly_path = sys.argv[1]
-    debug_mode = '--debug' in sys.argv
-
-    main(disassembly_path, debug_mode)
+    parser = argparse.ArgumentParser(usage="python run_emulator.py <path to disassembly or ROM> [--debug]")
+    parser.add_argument("disassembly_path", help="A .chs disassembly, or a .ch8 ROM to disassemble while it runs")
+    parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on http://127.0.0.1:<port>/metrics")
+    parser.add_argument("--metrics-log", type=float, default=None,
+                        help="Print a JSON metrics line every <seconds>")
+    args = parser.parse_args()
+
+    main(args.disassembly_path, args.debug, args.metrics_port, args.metrics_log)
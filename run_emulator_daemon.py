@@ -0,0 +1,149 @@
+import argparse
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import pygame
+
+from emulator import Emulator
+from cpu import CPU
+from run_emulator import EmulatorWindow, create_emulator
+from utils.utils_emulator import parse_disassembly, reload_disassembly
+
+DEFAULT_PORT = 8765
+WATCH_INTERVAL = 0.25
+
+
+class DaemonSession:
+    """
+    Keeps one pygame window, audio buffer and compiled instruction cache alive across ROM loads, and hot-reloads
+    the loaded `.chs` when it changes on disk.
+    """
+
+    def __init__(self):
+        self.commands = queue.Queue()
+        self.emulator = Emulator(cpu_type=CPU)
+        self.jit = None
+        self.path = None
+        self.mtime = None
+        self.loaded = None
+        self.last_watch = 0.0
+        self.running = True
+
+    def load(self, path):
+        if self.jit is not None:
+            self.jit.persist()
+        start = time.perf_counter()
+        self.emulator, self.jit = create_emulator(path)
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+        self.loaded = parse_disassembly(path) if self.jit is None else None
+        return f"loaded {path} in {(time.perf_counter() - start) * 1000:.1f} ms"
+
+    def reload(self):
+        start = time.perf_counter()
+        self.loaded, changed = reload_disassembly(self.emulator, self.path, self.loaded)
+        return f"reloaded {changed} lines of {self.path} in {(time.perf_counter() - start) * 1000:.1f} ms"
+
+    def handle(self, line):
+        name, _, argument = line.strip().partition(" ")
+        if name == "load":
+            return self.load(os.path.abspath(argument))
+        if name == "reset":
+            return self.load(self.path) if self.path else "nothing loaded"
+        if name == "quit":
+            self.running = False
+            return "bye"
+        return f"unknown command: {name}"
+
+    def poll(self):
+        while not self.commands.empty():
+            line, replies = self.commands.get()
+            try:
+                replies.put(self.handle(line))
+            except Exception as e:
+                replies.put(f"error: {e}")
+
+        now = time.perf_counter()
+        if self.loaded is None or now - self.last_watch < WATCH_INTERVAL:
+            return
+        self.last_watch = now
+
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime != self.mtime:
+            self.mtime = mtime
+            print(self.reload(), flush=True)
+
+
+def make_command_handler(session):
+    class CommandHandler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            for line in self.rfile:
+                replies = queue.Queue()
+                session.commands.put((line.decode().strip(), replies))
+                self.wfile.write((replies.get() + "\n").encode())
+
+    return CommandHandler
+
+
+def serve(port, path=None):
+    session = DaemonSession()
+    window = EmulatorWindow(caption='Chipstral Emulator Daemon')
+
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", port), make_command_handler(session))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Listening on 127.0.0.1:{port}", flush=True)
+
+    if path:
+        print(session.load(os.path.abspath(path)), flush=True)
+
+    loaded_emulator = session.emulator
+    while session.running:
+        session.poll()
+        if session.emulator is not loaded_emulator:
+            loaded_emulator = session.emulator
+            window.reset_keys()
+        if not window.step(session.emulator):
+            break
+
+    if session.jit is not None:
+        session.jit.persist()
+    server.shutdown()
+    pygame.quit()
+
+
+def send_command(port, command):
+    with socket.create_connection(("127.0.0.1", port)) as connection:
+        connection.sendall((command + "\n").encode())
+        return connection.makefile().readline().strip()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        usage="python run_emulator_daemon.py [serve [path]] | load <path> | reset | quit",
+        description="Long-lived emulator that loads ROMs on request and hot-reloads .chs files")
+    parser.add_argument("command", nargs="?", default="serve", choices=["serve", "load", "reset", "quit"])
+    parser.add_argument("path", nargs="?")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.port, args.path)
+    else:
+        if args.command == "load" and not args.path:
+            parser.error("load needs a path")
+        command = f"load {os.path.abspath(args.path)}" if args.command == "load" else args.command
+        try:
+            print(send_command(args.port, command))
+        except ConnectionRefusedError:
+            print(f"No emulator daemon listening on port {args.port}")
+            sys.exit(1)
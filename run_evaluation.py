@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from disassembler import Disassembler
+from utils.utils_emulator import parse_disassembly
+from utils.utils_llm import BACKENDS, LLMError, create_backend
+from utils.utils_metrics import LLMMetrics
+from utils.utils_prompts import PROMPT_FORMATS, PROMPT_VERSION, find_prompt_format
+from utils.utils_rules import opcode_family
+from utils.utils_scheduler import ScheduledBackend
+
+EVAL_PATH = "chipstral_eval.jsonl"
+
+
+class Scores:
+    def __init__(self):
+        self.totals = defaultdict(int)
+        self.matches = defaultdict(int)
+
+    def add(self, family, match):
+        self.totals[family] += 1
+        self.matches[family] += match
+
+    def exact_match(self, family=None):
+        if family is not None:
+            return self.matches[family] / self.totals[family]
+        total = sum(self.totals.values())
+        return sum(self.matches.values()) / total if total else 0.0
+
+    def to_dict(self):
+        return {family: {"samples": self.totals[family], "exact_match": round(self.exact_match(family), 4)}
+                for family in sorted(self.totals)}
+
+
+def evaluate_roms(paths, backend, prompt_version, concurrency, scores):
+    """
+    Disassemble each ROM with the LLM only and compare every instruction with its checked-in `.chs`. Addresses
+    decoded on one side only count as mismatches, so when an instruction gets no valid answer the walk stops there
+    and the instructions not reached are scored as misses.
+    """
+    for path in paths:
+        expected, _ = parse_disassembly(f"{os.path.splitext(path)[0]}.chs")
+        disassembler = Disassembler(llm_only=True, backend=backend, prompt_version=prompt_version)
+        disassembler.load_rom(path)
+        try:
+            if concurrency > 1:
+                asyncio.run(disassembler.decode_async(concurrency=concurrency))
+            else:
+                disassembler.decode()
+        except (LLMError, ValueError, KeyError, TypeError) as e:
+            print(f"{path}: decoding stopped, {e}")
+
+        for address in expected.keys() | disassembler.decoded_instructions.keys():
+            family = opcode_family(disassembler.read_opcode(address))
+            scores.add(family, disassembler.decoded_instructions.get(address) == expected.get(address))
+
+
+def evaluate_samples(path, backend, concurrency, limit, scores):
+    """
+    Send the user message of each fine-tuning sample as is and compare the answer with the assistant message.
+    """
+    with open(path) as f:
+        samples = [json.loads(line)["messages"] for line in f]
+    if limit:
+        samples = samples[:limit]
+
+    def evaluate(messages):
+        user, assistant = messages[0]["content"], messages[1]["content"]
+        prompt_format = find_prompt_format(user)
+        (_, opcode_hex), = prompt_format.items(user)
+        try:
+            answer = prompt_format.parse(backend.chat(user).content)
+        except (LLMError, ValueError, KeyError, TypeError):
+            answer = None
+        return opcode_family(opcode_hex), answer == prompt_format.parse(assistant)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for family, match in executor.map(evaluate, samples):
+            scores.add(family, match)
+
+
+def print_scores(title, scores):
+    print(f"{title}: {scores.exact_match():.2%} exact match over {sum(scores.totals.values())} instructions")
+    for family, result in scores.to_dict().items():
+        print(f"    {family:<6}{result['samples']:>7}{result['exact_match']:>9.2%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score the disassembler's accuracy and throughput")
+    parser.add_argument("--roms", nargs="*", default=sorted(glob.glob("roms/*.ch8")),
+                        help="ROMs compared with the .chs next to them")
+    parser.add_argument("--eval", default=EVAL_PATH, help="Fine-tuning evaluation samples, skipped if missing")
+    parser.add_argument("--limit", type=int, help="Only evaluate the first N samples")
+    parser.add_argument("--backend", choices=sorted(BACKENDS),
+                        help="LLM backend, defaults to the LLM_BACKEND environment variable or mistral")
+    parser.add_argument("--prompt-version", choices=list(PROMPT_FORMATS), default=PROMPT_VERSION)
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of LLM requests in flight")
+    parser.add_argument("--json", help="Write the results as JSON to this path")
+    parser.add_argument("--min-exact-match", type=float, help="Fail if the overall exact match is lower")
+    parser.add_argument("--min-calls-per-second", type=float, help="Fail if the LLM throughput is lower")
+    args = parser.parse_args()
+
+    metrics = LLMMetrics()
+    backend = ScheduledBackend(create_backend(args.backend), max_concurrency=args.concurrency, metrics=metrics)
+
+    start = time.perf_counter()
+    rom_scores = Scores()
+    evaluate_roms(args.roms, backend, args.prompt_version, args.concurrency, rom_scores)
+    sample_scores = Scores()
+    if os.path.exists(args.eval):
+        evaluate_samples(args.eval, backend, args.concurrency, args.limit, sample_scores)
+    elapsed = time.perf_counter() - start
+
+    summary = metrics.summary(sum(rom_scores.totals.values()) + sum(sample_scores.totals.values()))
+    calls_per_second = summary["llm_calls"] / elapsed
+    all_scores = Scores()
+    for scores in (rom_scores, sample_scores):
+        for family in scores.totals:
+            all_scores.totals[family] += scores.totals[family]
+            all_scores.matches[family] += scores.matches[family]
+
+    print_scores("ROMs", rom_scores)
+    if sample_scores.totals:
+        print_scores(args.eval, sample_scores)
+    print(f"{summary['llm_calls']} LLM calls in {elapsed:.1f}s ({calls_per_second:.1f} calls/s), "
+          f"p50 {summary['latency_p50_seconds']}s, p95 {summary['latency_p95_seconds']}s, "
+          f"estimated cost ${summary['estimated_cost_usd']:.4f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "exact_match": all_scores.exact_match(),
+                "roms": rom_scores.to_dict(),
+                "samples": sample_scores.to_dict(),
+                "elapsed_seconds": round(elapsed, 3),
+                "calls_per_second": round(calls_per_second, 2),
+                "llm": summary,
+            }, f, indent=2)
+
+    failed = []
+    if args.min_exact_match is not None and all_scores.exact_match() < args.min_exact_match:
+        failed.append(f"exact match {all_scores.exact_match():.2%} < {args.min_exact_match:.2%}")
+    if args.min_calls_per_second is not None and calls_per_second < args.min_calls_per_second:
+        failed.append(f"{calls_per_second:.1f} calls/s < {args.min_calls_per_second}")
+    if failed:
+        print("FAIL: " + ", ".join(failed))
+        raise SystemExit(1)
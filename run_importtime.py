@@ -0,0 +1,57 @@
+import argparse
+import subprocess
+import sys
+
+# Import budget in milliseconds for each entry point, and modules none of them may import at startup
+ENTRY_POINTS = {
+    "run_disassembler": 300,
+    "run_emulator": 600,
+    "dataset.generate_dataset": 100,
+}
+FORBIDDEN_MODULES = ("mistralai",)
+
+
+def measure_import(module):
+    """
+    Import `module` in a fresh interpreter with `-X importtime` and return (total milliseconds,
+    {module: cumulative milliseconds}).
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    imports = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        if name.strip() == "site":
+            # Everything up to here is interpreter startup
+            imports.clear()
+            continue
+        imports[name.strip()] = int(cumulative) / 1000
+    return imports.get(module, 0.0), imports
+
+
+def check_entry_point(module, budget, top):
+    total, imports = measure_import(module)
+    forbidden = sorted(name for name in imports if name.split(".")[0] in FORBIDDEN_MODULES)
+    slowest = sorted(((ms, name) for name, ms in imports.items() if name != module), reverse=True)[:top]
+
+    status = "OK" if total <= budget and not forbidden else "FAIL"
+    print(f"{status:<5}{module:<28}{total:8.1f} ms (budget {budget} ms)")
+    for ms, name in slowest:
+        print(f"{'':<9}{name:<40}{ms:8.1f} ms")
+    if forbidden:
+        print(f"{'':<9}imports {', '.join(forbidden)}")
+    return status == "OK"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the startup import time of each entry point")
+    parser.add_argument("--top", type=int, default=5, help="Number of slowest imports listed per entry point")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply the budgets, for slower machines")
+    args = parser.parse_args()
+
+    results = [check_entry_point(module, budget * args.scale, args.top) for module, budget in ENTRY_POINTS.items()]
+    sys.exit(0 if all(results) else 1)
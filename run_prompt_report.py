@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+import glob
+
+from disassembler import Disassembler
+from utils.utils_llm import BACKENDS, LLMError, create_backend
+from utils.utils_metrics import LLMMetrics
+from utils.utils_prompts import PROMPT_FORMATS
+from utils.utils_rules import decode_with_rules
+from utils.utils_scheduler import ScheduledBackend
+
+
+def evaluate_prompt_version(version, paths, backend_name=None, concurrency=1):
+    """
+    Disassemble every ROM with the LLM only, using one prompt version, and score the decodes of standard
+    opcodes against the dataset templates the model was fine-tuned on. A decode without a valid answer, e.g.
+    from a model fine-tuned on another prompt version, counts as a miss and stops the walk of its ROM.
+    """
+    metrics = LLMMetrics()
+    backend = ScheduledBackend(create_backend(backend_name), max_concurrency=concurrency, metrics=metrics)
+
+    decodes = 0
+    matches = 0
+    scored = 0
+    for path in paths:
+        disassembler = Disassembler(llm_only=True, backend=backend, prompt_version=version)
+        disassembler.load_rom(path)
+        try:
+            if concurrency > 1:
+                asyncio.run(disassembler.decode_async(concurrency=concurrency))
+            else:
+                disassembler.decode()
+        except (LLMError, ValueError, KeyError, TypeError) as e:
+            print(f"{version} {path}: decoding stopped, {e}")
+            scored += 1
+
+        decodes += len(disassembler.responses)
+        for address, (opcode_hex, response) in disassembler.responses.items():
+            expected = decode_with_rules(address, opcode_hex)
+            if expected is not None:
+                scored += 1
+                matches += response == expected
+
+    summary = metrics.summary(decodes)
+    calls = max(summary["llm_calls"], 1)
+    return {
+        "version": version,
+        "llm_calls": summary["llm_calls"],
+        "prompt_tokens_per_call": summary["prompt_tokens"] / calls,
+        "completion_tokens_per_call": summary["completion_tokens"] / calls,
+        "latency_p50_seconds": summary["latency_p50_seconds"],
+        "latency_p95_seconds": summary["latency_p95_seconds"],
+        "elapsed_seconds": summary["elapsed_seconds"],
+        "exact_match": matches / scored if scored else 0.0,
+    }
+
+
+def print_report(rows):
+    print(f"{'version':<9}{'calls':>7}{'prompt tok':>12}{'compl. tok':>12}{'p50 s':>9}{'p95 s':>9}"
+          f"{'total s':>9}{'exact':>8}")
+    for row in rows:
+        print(f"{row['version']:<9}{row['llm_calls']:>7}{row['prompt_tokens_per_call']:>12.1f}"
+              f"{row['completion_tokens_per_call']:>12.1f}{row['latency_p50_seconds']:>9.3f}"
+              f"{row['latency_p95_seconds']:>9.3f}{row['elapsed_seconds']:>9.1f}{row['exact_match']:>8.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare prompt versions on token usage, latency and accuracy")
+    parser.add_argument("roms", nargs="*", default=sorted(glob.glob("roms/*.ch8")))
+    parser.add_argument("--versions", nargs="+", choices=list(PROMPT_FORMATS), default=list(PROMPT_FORMATS))
+    parser.add_argument("--backend", choices=sorted(BACKENDS),
+                        help="LLM backend, defaults to the LLM_BACKEND environment variable or mistral")
+    parser.add_argument("--concurrency", type=int, default=1, help="Maximum number of LLM requests in flight")
+    args = parser.parse_args()
+
+    print_report([evaluate_prompt_version(version, args.roms, args.backend, args.concurrency)
+                  for version in args.versions])
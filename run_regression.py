@@ -0,0 +1,212 @@
+import argparse
+import contextlib
+import glob
+import hashlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cpu import CPU
+from emulator import Emulator
+from utils.utils_emulator import load_disassembly
+
+CYCLES_PER_FRAME = 10  # 600 Hz CPU, 60 Hz timers and display
+DEFAULT_FRAMES = 3000
+DEFAULT_CHECKPOINT_INTERVAL = 60
+DEFAULT_SLOWDOWN = 1.5
+DEFAULT_REPEATS = 3
+# Runs faster than this are too short to time reliably and never reported as slow
+DEFAULT_MIN_SECONDS = 0.05
+
+# A fixed loop of typical decoded instructions, timed next to each ROM to factor out the machine's speed
+CALIBRATION_CYCLES = 10000
+CALIBRATION_PROGRAM = {
+    0x200: "V[0x1] = (V[0x1] + 0x1) & 0xFF",
+    0x202: "I = (V[0x1] & 0x0F) * 5",
+    0x204: "draw_sprite(0x1, 0x2, 0x5)",
+    0x206: "PC += 2 if V[0x1] == 0x0 else 0",
+    0x208: "PC = 0x200",
+    0x20a: "PC = 0x200",
+}
+
+GOLDEN_PATH = "roms/golden.json"
+INPUTS_PATH = "roms/inputs.json"
+
+
+def default_input_script(frames):
+    # Tap every key in turn for a few frames so ROMs waiting on input make progress
+    script = []
+    for i, frame in enumerate(range(30, frames, 20)):
+        key = i % 16
+        script.append([frame, key, 1])
+        script.append([frame + 5, key, 0])
+    return script
+
+
+def hash_framebuffer(display):
+    return hashlib.sha1(bytes(pixel for row in display.pixels for pixel in row)).hexdigest()[:16]
+
+
+def play_headless(disassembly_path, frames, checkpoint_interval, script):
+    random.seed(0)
+    emulator = Emulator(cpu_type=CPU)
+    load_disassembly(emulator, disassembly_path)
+    cpu = emulator.cpu
+
+    events = {}
+    for frame, key, pressed in script:
+        events.setdefault(frame, []).append((key, pressed))
+
+    checkpoints = {}
+    start = time.perf_counter()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for frame in range(1, frames + 1):
+            for key, pressed in events.get(frame, ()):
+                cpu.keys[key] = pressed
+                if pressed and cpu.waiting_keypress:
+                    cpu.V[cpu.keypress_register] = key
+                    cpu.waiting_keypress = False
+
+            if not cpu.waiting_keypress:
+                for _ in range(CYCLES_PER_FRAME):
+                    emulator.cycle()
+
+            if cpu.DT > 0:
+                cpu.DT -= 1
+            if cpu.ST > 0:
+                cpu.ST -= 1
+
+            if frame % checkpoint_interval == 0:
+                checkpoints[str(frame)] = hash_framebuffer(emulator.display)
+
+    return {
+        "checkpoints": checkpoints,
+        "seconds": time.perf_counter() - start,
+        "errors": cpu.code_executor.error_count,
+    }
+
+
+def calibrate(cycles=CALIBRATION_CYCLES):
+    emulator = Emulator(cpu_type=CPU)
+    emulator.cpu.instructions.update(CALIBRATION_PROGRAM)
+    start = time.perf_counter()
+    for _ in range(cycles):
+        emulator.cycle()
+    return time.perf_counter() - start
+
+
+def run_rom(args):
+    """
+    Play a ROM `repeats` times, each after a calibration run. Its time is the median of the repeats, and also
+    given relative to the median calibration time so that goldens recorded on another machine stay comparable.
+    """
+    name, disassembly_path, frames, checkpoint_interval, script, repeats = args
+    calibrations = []
+    seconds = []
+    for _ in range(repeats):
+        calibrations.append(calibrate())
+        result = play_headless(disassembly_path, frames, checkpoint_interval, script)
+        seconds.append(result["seconds"])
+    result["seconds"] = statistics.median(seconds)
+    result["normalized"] = result["seconds"] / statistics.median(calibrations)
+    return name, result
+
+
+def compare(name, result, golden, slowdown, min_seconds=DEFAULT_MIN_SECONDS):
+    if golden is None:
+        return "NEW", None
+
+    for frame, expected in golden["checkpoints"].items():
+        actual = result["checkpoints"].get(frame)
+        if actual != expected:
+            return "DRIFT", f"frame {frame}: {actual} != {expected}"
+
+    if golden.get("normalized") and result["seconds"] >= min_seconds:
+        ratio = result["normalized"] / golden["normalized"]
+        if ratio > slowdown:
+            return "SLOW", f"{ratio:.2f}x slower relative to calibration"
+
+    return "OK", None
+
+
+def load_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(rom_dir, frames, checkpoint_interval, workers, update, slowdown, golden_path, inputs_path,
+         repeats=DEFAULT_REPEATS, min_seconds=DEFAULT_MIN_SECONDS):
+    goldens = load_json(golden_path)
+    inputs = load_json(inputs_path)
+
+    jobs = []
+    for disassembly_path in sorted(glob.glob(os.path.join(rom_dir, "*.chs"))):
+        name = os.path.basename(disassembly_path)
+        script = inputs.get(name, default_input_script(frames))
+        jobs.append((name, disassembly_path, frames, checkpoint_interval, script, repeats))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = dict(executor.map(run_rom, jobs))
+    total = time.perf_counter() - start
+
+    failures = 0
+    print(f"{'ROM':<20} {'STATUS':<7} {'TIME':>8} {'GOLDEN':>8} {'ERRORS':>6}  DETAILS")
+    for name, result in results.items():
+        golden = goldens.get(name)
+        if golden is not None and golden.get("frames") != frames:
+            golden = None
+        status, details = compare(name, result, golden, slowdown, min_seconds)
+        if status in ("DRIFT", "SLOW"):
+            failures += 1
+        golden_time = f"{golden['seconds']:.3f}s" if golden else "-"
+        print(f"{name:<20} {status:<7} {result['seconds']:>7.3f}s {golden_time:>8} {result['errors']:>6}  "
+              f"{details or ''}")
+
+    print(f"\n{len(results)} ROMs, {frames} frames each, in {total:.2f}s")
+
+    if update:
+        for name, result in results.items():
+            goldens[name] = {
+                "frames": frames,
+                "checkpoints": result["checkpoints"],
+                "seconds": round(result["seconds"], 4),
+                "normalized": round(result["normalized"], 4),
+            }
+        with open(golden_path, "w") as f:
+            json.dump(goldens, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Golden hashes written to {golden_path}")
+        return 0
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play every .chs headless and compare framebuffers with golden hashes")
+    parser.add_argument("rom_dir", nargs="?", default="roms")
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES)
+    parser.add_argument("--checkpoint-interval", type=int, default=DEFAULT_CHECKPOINT_INTERVAL)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--update", action="store_true", help="Record the current results as the new goldens")
+    parser.add_argument("--slowdown", type=float, default=DEFAULT_SLOWDOWN,
+                        help="Report ROMs running this many times slower than their golden time, both relative to "
+                             "a calibration loop")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS,
+                        help="Times each ROM is played, the median time is compared")
+    parser.add_argument("--min-seconds", type=float, default=DEFAULT_MIN_SECONDS,
+                        help="Never report runs shorter than this as slow")
+    parser.add_argument("--golden", default=GOLDEN_PATH)
+    parser.add_argument("--inputs", default=INPUTS_PATH, help="JSON of per-ROM [frame, key, pressed] scripts")
+    args = parser.parse_args()
+
+    sys.exit(main(args.rom_dir, args.frames, args.checkpoint_interval, args.workers, args.update, args.slowdown,
+                  args.golden, args.inputs, args.repeats, args.min_seconds))
@@ -0,0 +1,149 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.utils_llm import STANDIN_MODEL
+from utils.utils_prompts import find_prompt_format
+from utils.utils_rules import decode_with_rules
+
+DEFAULT_PORT = 8800
+
+
+class StandInConfig:
+    def __init__(self, latency=0.0, jitter=0.0, tail_rate=0.0, tail_factor=10.0, error_rate=0.0,
+                 rate_limit_rate=0.0, retry_after=1.0, malformed_rate=0.0, seed=None, faulty_models=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.tail_rate = tail_rate
+        self.tail_factor = tail_factor
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.malformed_rate = malformed_rate
+        self.faulty_models = faulty_models
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def draw(self):
+        with self.lock:
+            self.requests += 1
+            return self.random.random(), self.random.random(), self.random.uniform(-1, 1)
+
+
+def answer(prompt):
+    """
+    Decode every instruction found in the prompt the way the fine-tuning dataset templates do, in the response
+    format of the prompt's version. Opcodes outside the standard set are answered with a no-op.
+    """
+    prompt_format = find_prompt_format(prompt)
+    decodes = []
+    for address, opcode_hex in prompt_format.items(prompt):
+        decode = decode_with_rules(address, opcode_hex.lower())
+        decodes.append(prompt_format.encode(decode if decode is not None else {"decoded_instruction": "pass"}))
+
+    if prompt_format.is_batch(prompt):
+        return {prompt_format.batch_key: decodes}
+    return decodes[0] if decodes else prompt_format.encode({"decoded_instruction": "pass"})
+
+
+def make_standin_handler(config):
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if not self.path.endswith("/chat/completions"):
+                self.send_json(404, {"error": "not found"})
+                return
+
+            request = json.loads(body)
+            prompt = request["messages"][-1]["content"]
+
+            outcome, tail, jitter = config.draw()
+            if config.faulty_models and request.get("model") not in config.faulty_models:
+                outcome = 1.0
+            delay = config.latency * (1 + config.jitter * jitter)
+            if tail < config.tail_rate:
+                delay *= config.tail_factor
+            time.sleep(max(0.0, delay))
+
+            if outcome < config.rate_limit_rate:
+                self.send_json(429, {"error": "rate limited"}, {"Retry-After": str(config.retry_after)})
+                return
+            outcome -= config.rate_limit_rate
+            if outcome < config.error_rate:
+                self.send_json(500, {"error": "injected failure"})
+                return
+            outcome -= config.error_rate
+
+            if outcome < config.malformed_rate:
+                content = '{"decoded_instruction": '
+            else:
+                content = json.dumps(answer(prompt))
+
+            self.send_json(200, {
+                "id": f"standin-{config.requests}",
+                "object": "chat.completion",
+                "model": request.get("model", STANDIN_MODEL),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                          "total_tokens": (len(prompt) + len(content)) // 4},
+            })
+
+        def send_json(self, status, payload, headers=None):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StandInHandler
+
+
+def create_standin_server(config, port=DEFAULT_PORT):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_standin_handler(config))
+    server.daemon_threads = True
+    return server
+
+
+def start_standin_server(config, port=DEFAULT_PORT):
+    server = create_standin_server(config, port)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in for the fine-tuned disassembler")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="Base response time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Relative latency variation, e.g. 0.2 for +/-20%%")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="Fraction of requests that are slow")
+    parser.add_argument("--tail-factor", type=float, default=10.0, help="How much slower the slow requests are")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests failing with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of responses with broken JSON")
+    parser.add_argument("--faulty-models", type=lambda value: value.split(","),
+                        help="Only inject failures into requests for these comma-separated models")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = StandInConfig(args.latency, args.jitter, args.tail_rate, args.tail_factor, args.error_rate,
+                           args.rate_limit_rate, args.retry_after, args.malformed_rate, args.seed,
+                           args.faulty_models)
+    server = create_standin_server(config, args.port)
+    print(f"Stand-in LLM listening on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,134 @@
+import json
+import os
+import sqlite3
+import threading
+
+DEFAULT_CACHE_PATH = os.path.join("~", ".cache", "chipstral", "decode_cache.sqlite")
+DEFAULT_MAX_ENTRIES = 100_000
+# Opcode families whose targets are their nnn operand (SYS, JP, CALL, LD I, JP V0), the others are address-relative
+ABSOLUTE_FAMILIES = {0x0, 0x1, 0x2, 0xA, 0xB}
+
+
+def parse_address(value):
+    if isinstance(value, str):
+        value = value.strip()
+        return int(value, 16) if value[:2] == '0x' else int(value)
+    return int(value)
+
+
+def is_relative(opcode):
+    return opcode >> 12 not in ABSOLUTE_FAMILIES
+
+
+def normalize_response(address, opcode, response):
+    """
+    Rewrite the `block` and `marker` values of opcodes outside `ABSOLUTE_FAMILIES` (e.g. the `address + 4` of skip
+    instructions) relative to the address, so one cache entry serves the opcode wherever it appears. The family
+    decides, as a skip target can equal the opcode's low 12 bits by chance.
+    """
+    normalized = dict(response)
+    if not is_relative(opcode):
+        return normalized
+    for field in ("block", "marker"):
+        if field not in response:
+            continue
+        value = response[field]
+        try:
+            target = parse_address(value)
+        except ValueError:
+            continue
+        if isinstance(value, str):
+            representation = str(target) if str(target) in value else hex(target)
+            template = value.replace(representation, "{}", 1)
+            number_format = "dec" if representation == str(target) else "hex"
+        else:
+            template, number_format = None, "int"
+        normalized[field] = {"offset": target - address, "format": number_format, "template": template}
+    return normalized
+
+
+def denormalize_response(address, response):
+    denormalized = dict(response)
+    for field in ("block", "marker"):
+        value = response.get(field)
+        if not isinstance(value, dict):
+            continue
+        target = address + value["offset"]
+        if value["format"] == "int":
+            denormalized[field] = target
+        else:
+            representation = str(target) if value["format"] == "dec" else hex(target)
+            denormalized[field] = value["template"].format(representation)
+    return denormalized
+
+
+class DecodeCache:
+    """
+    Persistent LLM decode cache keyed by model, prompt version and opcode, with least-recently-used eviction.
+    """
+
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = os.path.expanduser(path or os.environ.get("CHIPSTRAL_CACHE", DEFAULT_CACHE_PATH))
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS decodes (key TEXT PRIMARY KEY, response TEXT NOT NULL, last_used INTEGER)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS decodes_last_used ON decodes (last_used)")
+        self.connection.commit()
+        self.clock = self.connection.execute("SELECT COALESCE(MAX(last_used), 0) FROM decodes").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, prompt_version, opcode_hex):
+        return f"{model}:{prompt_version}:{opcode_hex}"
+
+    def get(self, model, prompt_version, opcode_hex, address):
+        key = self.make_key(model, prompt_version, opcode_hex)
+        with self.lock:
+            row = self.connection.execute("SELECT response FROM decodes WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.clock += 1
+            self.connection.execute("UPDATE decodes SET last_used = ? WHERE key = ?", (self.clock, key))
+            self.connection.commit()
+        return denormalize_response(address, json.loads(row[0]))
+
+    def contains(self, model, prompt_version, opcode_hex):
+        key = self.make_key(model, prompt_version, opcode_hex)
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM decodes WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, model, prompt_version, opcode_hex, address, response):
+        key = self.make_key(model, prompt_version, opcode_hex)
+        normalized = normalize_response(address, int(opcode_hex, 16), response)
+        with self.lock:
+            self.clock += 1
+            self.connection.execute("INSERT OR REPLACE INTO decodes (key, response, last_used) VALUES (?, ?, ?)",
+                                    (key, json.dumps(normalized), self.clock))
+            excess = self.connection.execute("SELECT COUNT(*) FROM decodes").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.connection.execute(
+                    "DELETE FROM decodes WHERE key IN (SELECT key FROM decodes ORDER BY last_used LIMIT ?)", (excess,))
+            self.connection.commit()
+
+    def delete(self, model, prompt_version, opcode_hex):
+        key = self.make_key(model, prompt_version, opcode_hex)
+        with self.lock:
+            self.connection.execute("DELETE FROM decodes WHERE key = ?", (key,))
+            self.connection.commit()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -27,14 +27,14 @@ def format_registers(cpu):
     return column1, column2
 
 
-def display_emulator_debug(cpu):
+def display_emulator_debug(cpu, debugger=None):
     with Live(console=console, refresh_per_second=1) as live:
         while True:
-            layout = create_emulator_debug_layout(cpu)
+            layout = create_emulator_debug_layout(cpu, debugger)
             live.update(layout)
 
 
-def create_emulator_debug_layout(cpu):
+def create_emulator_debug_layout(cpu, debugger=None):
     window_size = 24
     instructions = []
     start_pc = max(0x200, cpu.PC - (window_size // 2) * 2)
@@ -53,23 +53,46 @@ def create_emulator_debug_layout(cpu):
     column1, column2 = format_registers(cpu)
 
     upper_layout = Layout()
-    upper_layout.split_row(
+    columns = [
         Layout(Panel("\n".join(instructions), title="[bold blue]Instructions[/bold blue]"), ratio=4),
         Layout(Panel("\n".join(column1))),
         Layout(Panel("\n".join(column2)))
-    )
+    ]
+    if debugger is not None:
+        columns.append(Layout(Panel("\n".join(debugger.describe()), title="[bold blue]Debugger[/bold blue]"), ratio=2))
+    upper_layout.split_row(*columns)
 
     layout.update(upper_layout)
 
     return layout
 
 
-def start_emulator_debug_thread(cpu):
-    emulator_debug_thread = threading.Thread(target=display_emulator_debug, args=(cpu,), daemon=True)
+def start_emulator_debug_thread(cpu, debugger=None):
+    emulator_debug_thread = threading.Thread(target=display_emulator_debug, args=(cpu, debugger), daemon=True)
     emulator_debug_thread.start()
     return emulator_debug_thread
 
 
+def read_debugger_commands(debugger):
+    while True:
+        try:
+            line = input()
+        except EOFError:
+            break
+        try:
+            message = debugger.command(line.strip())
+        except (ValueError, SyntaxError) as e:
+            message = f"Invalid command: {e}"
+        if message:
+            console.log(message)
+
+
+def start_debugger_command_thread(debugger):
+    command_thread = threading.Thread(target=read_debugger_commands, args=(debugger,), daemon=True)
+    command_thread.start()
+    return command_thread
+
+
 def display_disassembler_debug(disassembler):
     with Live(console=console, refresh_per_second=1) as live:
         while True:
@@ -81,7 +104,7 @@ def create_disassembler_layout(disassembler):
     window_size = 12
     layout = Layout()
 
-    if len(disassembler.disassembly_history) == 0 or len(disassembler.llm_history) == 0:
+    if len(disassembler.disassembly_history) == 0:
         return layout
 
     disassembly_history = [
@@ -89,10 +112,18 @@ def create_disassembler_layout(disassembler):
         for address, opcode_hex, decoded in disassembler.disassembly_history
     ]
 
-    prompt, response = disassembler.llm_history[-1]
-    prompt = prompt.replace('\n\n', '\n')
-
-    llm_entry = f"Prompt: [bold magenta]{prompt}[/bold magenta]\n\nResponse: [bold red]{json.dumps(response)}[/bold red]"
+    if len(disassembler.llm_history) > 0:
+        prompt, response = disassembler.llm_history[-1]
+        prompt = prompt.replace('\n\n', '\n')
+        llm_entry = f"Prompt: [bold magenta]{prompt}[/bold magenta]\n\nResponse: [bold red]{json.dumps(response)}[/bold red]"
+    else:
+        llm_entry = "No LLM calls yet"
+    llm_entry += f"\n\nLLM calls: {disassembler.llm_calls}, rule decodes: {disassembler.rule_decodes}"
+    if hasattr(disassembler.backend, "stats"):
+        stats = disassembler.backend.stats()
+        llm_entry += f"\nQueue depth: {stats['queue_depth']}, " \
+                     f"in flight: {stats['in_flight']}/{stats['concurrency']}, " \
+                     f"retries: {stats['retries']}, throttled: {stats['throttled']}"
 
     layout.split_column(
         Layout(Panel(llm_entry, title="LLM")),
@@ -0,0 +1,63 @@
+import json
+import os
+import threading
+
+
+def index_path(disassembly_path):
+    return f"{disassembly_path}.idx"
+
+
+def temp_path_for(path):
+    # Unique per process and thread, so that concurrent writers never share a temporary file
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def write_disassembly(lines, disassembly_path, with_index=True):
+    """
+    Write (address, line) pairs to a temporary file renamed over `disassembly_path` once complete, and the byte
+    offset of every address to the index sidecar.
+    """
+    offsets = {}
+    offset = 0
+    temp_path = temp_path_for(disassembly_path)
+    # Binary, so that the offsets are those of the file on platforms that write newlines as \r\n
+    with open(temp_path, "wb") as f:
+        for address, line in lines:
+            data = line.encode()
+            f.write(data)
+            offsets[address] = offset
+            offset += len(data)
+    os.replace(temp_path, disassembly_path)
+
+    if with_index:
+        temp_path = temp_path_for(index_path(disassembly_path))
+        with open(temp_path, "w") as f:
+            json.dump({"size": offset, "offsets": offsets}, f, separators=(",", ":"))
+        os.replace(temp_path, index_path(disassembly_path))
+
+
+def read_index(disassembly_path):
+    """
+    Return {address: byte offset} from the index sidecar, or None if it is missing or does not match the file.
+    """
+    try:
+        with open(index_path(disassembly_path)) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index["size"] != os.path.getsize(disassembly_path):
+        return None
+    return {int(address): offset for address, offset in index["offsets"].items()}
+
+
+def read_line(disassembly_path, address, index=None):
+    """
+    Return the instruction (or `DB 0x..`) at `address`, seeking through the index instead of parsing the file.
+    """
+    index = index if index is not None else read_index(disassembly_path)
+    if index is None or address not in index:
+        return None
+    with open(disassembly_path, "rb") as f:
+        f.seek(index[address])
+        line = f.readline().decode()
+    return line.rstrip("\n").split("\t", 1)[1]
@@ -29,7 +29,9 @@ def generate_beep_sound(frequency=440, duration=0.5, volume=0.5, sample_rate=441
     return sound
 
 
-def load_disassembly(emulator, disassembly_path):
+def parse_disassembly(disassembly_path):
+    instructions = {}
+    data = {}
     with open(disassembly_path, 'r') as f:
         disassembly = f.read()
         for line in disassembly.split('\n'):
@@ -39,6 +41,39 @@ def load_disassembly(emulator, disassembly_path):
                 address, instruction = line.split('\t')
                 address = int(address, 16)
                 if instruction.split()[0] == 'DB':
-                    emulator.memory.write_byte(address, int(instruction.split()[1], 16))
+                    data[address] = int(instruction.split()[1], 16)
                 else:
-                    emulator.cpu.instructions[address] = instruction
+                    instructions[address] = instruction
+    return instructions, data
+
+
+def load_disassembly(emulator, disassembly_path):
+    instructions, data = parse_disassembly(disassembly_path)
+    for address, value in data.items():
+        emulator.memory.write_byte(address, value)
+    emulator.cpu.instructions.update(instructions)
+    return instructions, data
+
+
+def reload_disassembly(emulator, disassembly_path, previous):
+    """
+    Re-read a disassembly that was loaded before and apply only the lines that changed since `previous`,
+    the (instructions, data) pair returned by the last load, leaving the rest of the machine state untouched.
+    """
+    previous_instructions, previous_data = previous
+    instructions, data = parse_disassembly(disassembly_path)
+    changed = 0
+
+    for address in previous_instructions.keys() - instructions.keys():
+        emulator.cpu.instructions.pop(address, None)
+        changed += 1
+    for address, instruction in instructions.items():
+        if previous_instructions.get(address) != instruction:
+            emulator.cpu.instructions[address] = instruction
+            changed += 1
+    for address, value in data.items():
+        if previous_data.get(address) != value:
+            emulator.memory.write_byte(address, value)
+            changed += 1
+
+    return (instructions, data), changed
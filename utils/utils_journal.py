@@ -0,0 +1,65 @@
+import json
+import os
+
+DEFAULT_FLUSH_EVERY = 16
+
+
+def read_journal(path):
+    """
+    Return {address: (opcode_hex, response)} from a decode journal. A last line cut short by a crash has no
+    trailing newline and is ignored.
+    """
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path) as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries[entry["address"]] = (entry["opcode"], entry["response"])
+    return entries
+
+
+class DecodeJournal:
+    """
+    Append-only log of decodes, one JSON line each, written in batches of `flush_every` lines.
+    """
+
+    def __init__(self, path, resume=False, flush_every=DEFAULT_FLUSH_EVERY):
+        self.path = path
+        self.flush_every = flush_every
+        self.buffer = []
+
+        if resume and os.path.exists(path):
+            self.truncate_partial_line()
+            self.file = open(path, "a")
+        else:
+            self.file = open(path, "w")
+
+    def truncate_partial_line(self):
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                f.truncate(end)
+
+    def append(self, address, opcode_hex, response):
+        self.buffer.append(json.dumps({"address": address, "opcode": opcode_hex, "response": response}) + "\n")
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.file.write("".join(self.buffer))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
@@ -1,36 +1,203 @@
+import http.client
+import json
 import os
-
-from mistralai.client import MistralClient
-from mistralai.models.chat_completion import ChatMessage
+import queue
+from urllib.parse import urlsplit
 
 from dotenv import load_dotenv
 
-load_dotenv()
+# The prompts moved to utils_prompts, they are re-exported for existing imports
+from utils.utils_prompts import (INSTRUCTION_PROMPT, USER_PROMPT, BATCH_USER_PROMPT, BATCH_ITEM_PROMPT,
+                                 PROMPT_VERSION)
+
+STANDIN_BASE_URL = "http://127.0.0.1:8800/v1"
+STANDIN_MODEL = "chipstral-standin"
+BACKENDS = ("mistral", "openai", "standin")
+
+# USD per million tokens of the fine-tuned open-mistral-7b, override with LLM_PROMPT_PRICE / LLM_COMPLETION_PRICE
+PROMPT_PRICE = 0.25
+COMPLETION_PRICE = 0.25
+
+
+class LLMResponse:
+    def __init__(self, content, prompt_tokens=0, completion_tokens=0):
+        self.content = content
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+class LLMError(Exception):
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(headers):
+    for name, value in (headers or {}).items():
+        if name.lower() == "retry-after":
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+class LLMBackend:
+    """
+    A chat model that answers one user prompt with a JSON object. Implementations return an `LLMResponse`
+    and raise `LLMError` on failures.
+    """
+
+    model = None
+
+    def chat(self, prompt, temperature=0):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MistralBackend(LLMBackend):
+    """
+    The mistralai package is only imported, and the API key only read, when the first request is made.
+    """
+
+    def __init__(self, api_key=None, model=None):
+        self.model = model
+        self.api_key = api_key
+        self.client = None
+
+    def chat(self, prompt, temperature=0):
+        from mistralai.client import MistralClient
+        from mistralai.exceptions import MistralAPIException, MistralException
+        from mistralai.models.chat_completion import ChatMessage
+
+        if self.client is None:
+            # Retries are left to the ScheduledBackend, which backs off on 429s and honours Retry-After
+            self.client = MistralClient(api_key=self.api_key or os.environ["MISTRAL_API_KEY"], max_retries=0)
+
+        messages = [
+            ChatMessage(role='user', content=prompt)
+        ]
+
+        try:
+            response = self.client.chat(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                response_format={"type": "json_object"},
+            )
+        except MistralAPIException as e:
+            raise LLMError(str(e), e.http_status, parse_retry_after(e.headers)) from e
+        except MistralException as e:
+            raise LLMError(str(e)) from e
+
+        usage = response.usage
+        return LLMResponse(response.choices[0].message.content, usage.prompt_tokens, usage.completion_tokens)
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    Any server implementing the OpenAI `/chat/completions` API, over a pool of keep-alive connections.
+    """
+
+    def __init__(self, base_url, model, api_key=None, pool_size=8, timeout=60):
+        self.model = model
+        self.api_key = api_key
+        self.timeout = timeout
+        url = urlsplit(base_url)
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path.rstrip("/") + "/chat/completions"
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+
+    def connect(self):
+        connection_type = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return connection_type(self.host, self.port, timeout=self.timeout)
+
+    def chat(self, prompt, temperature=0):
+        body = json.dumps({
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+            "response_format": {"type": "json_object"},
+        }).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+
+        try:
+            connection = self.pool.get_nowait()
+        except queue.Empty:
+            connection = self.connect()
+
+        try:
+            connection.request("POST", self.path, body, headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise LLMError(str(e)) from e
+
+        try:
+            self.pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+        if response.status >= 400:
+            raise LLMError(data.decode(errors="replace"), response.status,
+                           parse_retry_after(dict(response.getheaders())))
+
+        payload = json.loads(data)
+        usage = payload.get("usage") or {}
+        return LLMResponse(payload["choices"][0]["message"]["content"], usage.get("prompt_tokens", 0),
+                           usage.get("completion_tokens", 0))
+
+    def close(self):
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+
+def estimate_cost(prompt_tokens, completion_tokens):
+    prompt_price = float(os.environ.get("LLM_PROMPT_PRICE", PROMPT_PRICE))
+    completion_price = float(os.environ.get("LLM_COMPLETION_PRICE", COMPLETION_PRICE))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def create_backend(name=None, model=None):
+    load_dotenv()
+    name = name or os.environ.get("LLM_BACKEND", "mistral")
+    if name == "mistral":
+        return MistralBackend(os.environ.get("MISTRAL_API_KEY"), model or os.environ["MODEL"])
+    if name == "openai":
+        return OpenAICompatibleBackend(os.environ["LLM_BASE_URL"], model or os.environ["MODEL"],
+                                       os.environ.get("LLM_API_KEY"))
+    if name == "standin":
+        return OpenAICompatibleBackend(os.environ.get("LLM_BASE_URL", STANDIN_BASE_URL),
+                                       model or os.environ.get("STANDIN_MODEL", STANDIN_MODEL))
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+default_backend = None
 
-api_key = os.environ["MISTRAL_API_KEY"]
-model = os.environ["MODEL"]
 
-client = MistralClient(api_key=api_key)
+def get_backend():
+    global default_backend
+    if default_backend is None:
+        default_backend = create_backend()
+    return default_backend
 
-INSTRUCTION_PROMPT = "You're the CHIP-8 Disassembler, interpreting hexadecimal instructions and providing the " \
-                     "corresponding disassembly in Python code. Each instruction will be provided in the format of four " \
-                     "hexadecimal digits along with the current address in decimal format in the machine's memory. Your task " \
-                     "is to understand each instruction and respond with the appropriate Python code that disassembles the " \
-                     "instruction into a human-readable format based on the provided address.\n\n"
 
-USER_PROMPT = "{}\n\nAddress: {}, Instruction: {}"
+def __getattr__(name):
+    # `backend` and `model` are created on first access rather than on import
+    if name == "backend":
+        return get_backend()
+    if name == "model":
+        return get_backend().model
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def call_llm(prompt, temperature=0):
-    messages = [
-        ChatMessage(role='user', content=prompt)
-    ]
-
-    response = client.chat(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-        response_format={"type": "json_object"},
-    )
-
-    return response
+    return get_backend().chat(prompt, temperature)
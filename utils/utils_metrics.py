@@ -0,0 +1,201 @@
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.utils_llm import estimate_cost
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class EmulatorMetrics:
+    """
+    Counters updated from the emulator loop. The loop only increments numbers and appends to bounded
+    deques; rates and percentiles are computed by `aggregate`, which runs on the metrics thread.
+    """
+
+    def __init__(self, cpu, window=600):
+        self.cpu = cpu
+        self.cycles = 0
+        self.frames = 0
+        self.cpu_time = 0.0
+        self.render_time = 0.0
+        self.frame_times = deque(maxlen=window)
+        self.input_latencies = deque(maxlen=window)
+        self.input_time = None
+        self.last_frame = None
+        self.snapshot = {}
+        self.previous = (time.perf_counter(), 0, 0)
+
+    def record_input(self):
+        if self.input_time is None:
+            self.input_time = time.perf_counter()
+
+    def record_frame(self, start, cpu_end, render_end):
+        self.cpu_time += cpu_end - start
+        self.render_time += render_end - cpu_end
+        self.frames += 1
+        if self.last_frame is not None:
+            self.frame_times.append(render_end - self.last_frame)
+        self.last_frame = render_end
+        if self.input_time is not None:
+            self.input_latencies.append(render_end - self.input_time)
+            self.input_time = None
+
+    def aggregate(self):
+        now = time.perf_counter()
+        previous_time, previous_cycles, previous_frames = self.previous
+        cycles, frames = self.cycles, self.frames
+        elapsed = max(now - previous_time, 1e-9)
+        self.previous = (now, cycles, frames)
+
+        frame_times = list(self.frame_times)
+        input_latencies = list(self.input_latencies)
+
+        self.snapshot = {
+            "cycles_total": cycles,
+            "frames_total": frames,
+            "cycles_per_second": (cycles - previous_cycles) / elapsed,
+            "frames_per_second": (frames - previous_frames) / elapsed,
+            "frame_time_p50_seconds": percentile(frame_times, 50),
+            "frame_time_p95_seconds": percentile(frame_times, 95),
+            "frame_time_p99_seconds": percentile(frame_times, 99),
+            "input_latency_p50_seconds": percentile(input_latencies, 50),
+            "input_latency_p99_seconds": percentile(input_latencies, 99),
+            "execution_errors_total": self.cpu.code_executor.error_count,
+            "cpu_seconds_total": self.cpu_time,
+            "render_seconds_total": self.render_time,
+        }
+        return self.snapshot
+
+    def prometheus(self):
+        lines = []
+        for name, value in self.snapshot.items():
+            metric_type = "counter" if name.endswith("_total") else "gauge"
+            lines.append(f"# TYPE chipstral_{name} {metric_type}")
+            lines.append(f"chipstral_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class LLMMetrics:
+    """
+    Registry of LLM calls made during a disassembly: latency of each attempt, token usage, retries and decode cache
+    lookups. With a `log_file`, every call is also written to it as one JSON line.
+    """
+
+    def __init__(self, log_file=None):
+        self.log_file = log_file
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.calls = 0
+        self.failed_calls = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.start = time.perf_counter()
+
+    def record_call(self, latency, response=None, error=None, attempt=0):
+        with self.lock:
+            self.latencies.append(latency)
+            if response is not None:
+                self.calls += 1
+                self.prompt_tokens += response.prompt_tokens
+                self.completion_tokens += response.completion_tokens
+            else:
+                self.failed_calls += 1
+            if attempt:
+                self.retries += 1
+            if self.log_file is not None:
+                entry = {"time": time.time(), "latency": round(latency, 6), "attempt": attempt}
+                if response is not None:
+                    entry.update(prompt_tokens=response.prompt_tokens, completion_tokens=response.completion_tokens)
+                else:
+                    entry.update(status=error.status, error=str(error)[:200])
+                self.log_file.write(json.dumps(entry) + "\n")
+                self.log_file.flush()
+
+    def record_cache(self, hits, misses):
+        with self.lock:
+            self.cache_hits += hits
+            self.cache_misses += misses
+
+    def histogram(self):
+        # Cumulative counts per upper bound in seconds, as in Prometheus histograms
+        counts = {str(bound): sum(latency <= bound for latency in self.latencies) for bound in LATENCY_BUCKETS}
+        counts["+Inf"] = len(self.latencies)
+        return counts
+
+    def summary(self, decodes):
+        with self.lock:
+            elapsed = time.perf_counter() - self.start
+            return {
+                "decodes": decodes,
+                "elapsed_seconds": round(elapsed, 3),
+                "decodes_per_second": round(decodes / elapsed, 1) if elapsed > 0 else 0.0,
+                "llm_calls": self.calls,
+                "failed_calls": self.failed_calls,
+                "retries": self.retries,
+                "latency_p50_seconds": round(percentile(self.latencies, 50), 4),
+                "latency_p95_seconds": round(percentile(self.latencies, 95), 4),
+                "latency_p99_seconds": round(percentile(self.latencies, 99), 4),
+                "latency_histogram": self.histogram(),
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "estimated_cost_usd": round(estimate_cost(self.prompt_tokens, self.completion_tokens), 6),
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+            }
+
+
+def make_metrics_handler(metrics):
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
+
+
+def run_metrics_aggregator(metrics, interval=1.0, log_interval=None):
+    last_log = time.perf_counter()
+    while True:
+        time.sleep(interval)
+        snapshot = metrics.aggregate()
+        if log_interval and time.perf_counter() - last_log >= log_interval:
+            last_log = time.perf_counter()
+            print(json.dumps(snapshot), flush=True)
+
+
+def start_metrics_threads(metrics, port=None, log_interval=None):
+    aggregator_thread = threading.Thread(target=run_metrics_aggregator, args=(metrics, 1.0, log_interval),
+                                         daemon=True)
+    aggregator_thread.start()
+
+    if port is not None:
+        server = ThreadingHTTPServer(("127.0.0.1", port), make_metrics_handler(metrics))
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+
+    return aggregator_thread
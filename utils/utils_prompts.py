@@ -0,0 +1,118 @@
+import json
+import re
+
+INSTRUCTION_PROMPT = "You're the CHIP-8 Disassembler, interpreting hexadecimal instructions and providing the " \
+                     "corresponding disassembly in Python code. Each instruction will be provided in the format of four " \
+                     "hexadecimal digits along with the current address in decimal format in the machine's memory. Your task " \
+                     "is to understand each instruction and respond with the appropriate Python code that disassembles the " \
+                     "instruction into a human-readable format based on the provided address.\n\n"
+
+USER_PROMPT = "{}\n\nAddress: {}, Instruction: {}"
+
+BATCH_USER_PROMPT = "{}\n\nDecode each of the following instructions. Respond with a JSON object whose " \
+                    "\"instructions\" array holds one decode per instruction, in the same order.\n\n{}"
+
+BATCH_ITEM_PROMPT = "Address: {}, Instruction: {}"
+
+# Default prompt version. Add a new version to PROMPT_FORMATS whenever the prompts or the expected response format
+# change, cached decodes are keyed on it
+PROMPT_VERSION = "v1"
+
+COMPACT_INSTRUCTION_PROMPT = "CHIP-8 disassembler. Input: decimal address and opcode. Reply with JSON: i = Python " \
+                             "code, m = address loaded in I or called, b = branch target, e = 1 if control does " \
+                             "not fall through."
+
+COMPACT_USER_PROMPT = "{}\n{} {}"
+
+COMPACT_BATCH_USER_PROMPT = "{}\nDecode each line, reply with {{\"r\": [...]}} in the same order.\n{}"
+
+COMPACT_BATCH_ITEM_PROMPT = "{} {}"
+
+COMPACT_KEYS = {"decoded_instruction": "i", "marker": "m", "block": "b", "block_end": "e"}
+
+
+class PromptFormat:
+    """
+    How decode requests are worded for one prompt version, and how the model's answers are read back into the
+    response format of the v1 dataset.
+    """
+
+    def __init__(self, version, instruction, user, batch_user, batch_item, batch_key, item_pattern):
+        self.version = version
+        self.instruction = instruction
+        self.user = user
+        self.batch_user = batch_user
+        self.batch_item = batch_item
+        self.batch_key = batch_key
+        self.item_pattern = re.compile(item_pattern, re.MULTILINE)
+
+    def prompt(self, address, opcode_hex):
+        return self.user.format(self.instruction, address, opcode_hex)
+
+    def batch_prompt(self, items):
+        lines = "\n".join(self.batch_item.format(address, opcode_hex) for address, opcode_hex in items)
+        return self.batch_user.format(self.instruction, lines)
+
+    def matches(self, prompt):
+        return prompt.startswith(self.instruction)
+
+    def is_batch(self, prompt):
+        return prompt.startswith(self.batch_user.format(self.instruction, ""))
+
+    def items(self, prompt):
+        return [(int(address), opcode_hex) for address, opcode_hex in self.item_pattern.findall(prompt)]
+
+    def encode(self, response):
+        return response
+
+    def decode(self, response):
+        return response
+
+    def parse(self, content):
+        return self.decode(json.loads(content))
+
+    def parse_batch(self, content):
+        decodes = json.loads(content)[self.batch_key]
+        return [self.decode(decode) if isinstance(decode, dict) else decode for decode in decodes]
+
+
+class CompactPromptFormat(PromptFormat):
+    """
+    Short instructions, address and opcode only, and single-letter response keys with `e: 1` for block ends.
+    """
+
+    def encode(self, response):
+        return {COMPACT_KEYS[key]: 1 if key == "block_end" else value for key, value in response.items()}
+
+    def decode(self, response):
+        expanded = {}
+        for key, short_key in COMPACT_KEYS.items():
+            if short_key not in response:
+                continue
+            if key != "block_end":
+                expanded[key] = response[short_key]
+            elif response[short_key]:
+                expanded[key] = "True"
+        return expanded
+
+
+PROMPT_FORMATS = {
+    "v1": PromptFormat("v1", INSTRUCTION_PROMPT, USER_PROMPT, BATCH_USER_PROMPT, BATCH_ITEM_PROMPT, "instructions",
+                       r"Address: (\d+), Instruction: (0x[0-9a-fA-F]{4})"),
+    "v2": CompactPromptFormat("v2", COMPACT_INSTRUCTION_PROMPT, COMPACT_USER_PROMPT, COMPACT_BATCH_USER_PROMPT,
+                              COMPACT_BATCH_ITEM_PROMPT, "r", r"^(\d+) (0x[0-9a-fA-F]{4})$"),
+}
+
+
+def get_prompt_format(version=PROMPT_VERSION):
+    if version not in PROMPT_FORMATS:
+        raise ValueError(f"Unknown prompt version: {version}")
+    return PROMPT_FORMATS[version]
+
+
+def find_prompt_format(prompt):
+    # The compact instructions are checked first, they are not a prefix of the v1 ones
+    for prompt_format in reversed(PROMPT_FORMATS.values()):
+        if prompt_format.matches(prompt):
+            return prompt_format
+    return PROMPT_FORMATS[PROMPT_VERSION]
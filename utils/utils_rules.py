@@ -0,0 +1,99 @@
+"""
+Local decoder for the standard CHIP-8 opcodes.
+
+Each rule produces exactly the assistant message the model was fine-tuned on (see dataset/opcode_messages.py), so
+instructions it recognises never need a round-trip to the LLM.
+"""
+
+
+def _skip(decoded):
+    return lambda address, f: {"decoded_instruction": decoded.format(**f), "block": f"{address + 4}"}
+
+
+def _plain(decoded):
+    return lambda address, f: {"decoded_instruction": decoded.format(**f)}
+
+
+RULES = [
+    # (mask, value, rule)
+    (0xFFFF, 0x00E0, _plain("display.clear()")),
+    (0xFFFF, 0x00EE, lambda address, f: {"decoded_instruction": "PC = stack.pop()", "block_end": "True"}),
+    (0xF000, 0x1000, lambda address, f: {"decoded_instruction": f"PC = {f['nnn']}", "marker": f['nnn'],
+                                         "block": f['nnn'], "block_end": "True"}),
+    (0xF000, 0x2000, lambda address, f: {"decoded_instruction": f"stack.append(PC); PC = {f['nnn']}",
+                                         "marker": f['nnn'], "block": f['nnn']}),
+    (0xF000, 0x3000, _skip("PC += 2 if V[{x}] == {kk} else 0")),
+    (0xF000, 0x4000, _skip("PC += 2 if V[{x}] != {kk} else 0")),
+    (0xF00F, 0x5000, _skip("PC += 2 if V[{x}] == V[{y}] else 0")),
+    (0xF000, 0x6000, _plain("V[{x}] = {kk}")),
+    (0xF000, 0x7000, _plain("V[{x}] = (V[{x}] + {kk}) & 0xFF")),
+    (0xF00F, 0x8000, _plain("V[{x}] = V[{y}]")),
+    (0xF00F, 0x8001, _plain("V[{x}] = V[{x}] | V[{y}]")),
+    (0xF00F, 0x8002, _plain("V[{x}] = V[{x}] & V[{y}]")),
+    (0xF00F, 0x8003, _plain("V[{x}] = V[{x}] ^ V[{y}]")),
+    (0xF00F, 0x8004, _plain("result = V[{x}] + V[{y}]; V[{x}] = result & 0xFF; V[0xF] = 1 if result > 0xFF else 0; ")),
+    (0xF00F, 0x8005, _plain("borrow = 1 if V[{x}] >= V[{y}] else 0; V[{x}] = (V[{x}] - V[{y}]) & 0xFF; "
+                            "V[0xF] = borrow")),
+    (0xF00F, 0x8006, _plain("lsb = V[{x}] & 0x1; V[{x}] = V[{x}] >> 1; V[0xF] = lsb")),
+    (0xF00F, 0x8007, _plain("not_borrow = 1 if V[{y}] >= V[{x}] else 0; V[{x}] = (V[{y}] - V[{x}]) & 0xFF; "
+                            "V[0xF] = not_borrow")),
+    (0xF00F, 0x800E, _plain("msb = (V[{y}] & 0x80) >> 7; V[{x}] = (V[{y}] << 1) & 0xFF; V[0xF] = msb")),
+    (0xF00F, 0x9000, _skip("PC += 2 if V[{x}] != V[{y}] else 0")),
+    (0xF000, 0xA000, lambda address, f: {"decoded_instruction": f"I = {f['nnn']}", "marker": f['nnn']}),
+    (0xF000, 0xB000, lambda address, f: {"decoded_instruction": f"PC = {f['nnn']} + V[0]", "block": f['nnn'],
+                                         "block_end": "True"}),
+    (0xF000, 0xC000, _plain("V[{x}] = random.randint(0, 255) & {kk}")),
+    (0xF000, 0xD000, _plain("draw_sprite({x}, {y}, {n})")),
+    (0xF0FF, 0xE09E, lambda address, f: {"decoded_instruction": f"PC += 2 if keys[V[{f['x']}]] else 0",
+                                         "block": f"{address + 4} "}),
+    (0xF0FF, 0xE0A1, _skip("PC += 2 if not keys[V[{x}]] else 0")),
+    (0xF0FF, 0xF007, _plain("V[{x}] = DT")),
+    (0xF0FF, 0xF00A, _plain("waiting_keypress = True; keypress_register = {x}")),
+    (0xF0FF, 0xF015, _plain("DT = V[{x}]")),
+    (0xF0FF, 0xF018, _plain("ST = V[{x}]")),
+    (0xF0FF, 0xF01E, _plain("I = (I + V[{x}]) & 0xFFFF")),
+    (0xF0FF, 0xF029, _plain("I = (V[{x}] & 0x0F) * 5")),
+    (0xF0FF, 0xF033, _plain("value = V[{x}]; memory[I] = value // 100; memory[I + 1] = (value // 10) % 10; "
+                            "memory[I + 2] = value % 10")),
+    (0xF0FF, 0xF055, _plain("memory[I:I + {x} + 1] = V[:{x} + 1]")),
+    (0xF0FF, 0xF065, _plain("V[:{x} + 1] = memory[I:I + {x} + 1]")),
+]
+
+
+def opcode_fields(opcode):
+    return {
+        "nnn": hex(opcode & 0x0FFF),
+        "x": hex((opcode >> 8) & 0xF),
+        "y": hex((opcode >> 4) & 0xF),
+        "n": hex(opcode & 0xF),
+        "kk": hex(opcode & 0xFF),
+    }
+
+
+def decode_with_rules(address, opcode):
+    if isinstance(opcode, str):
+        opcode = int(opcode, 16)
+    for mask, value, rule in RULES:
+        if opcode & mask == value:
+            return rule(address, opcode_fields(opcode))
+    return None
+
+
+FAMILIES = ["0nnn", "1nnn", "2nnn", "3xkk", "4xkk", "5xy0", "6xkk", "7xkk", "8xy", "9xy0", "Annn", "Bnnn", "Cxkk",
+            "Dxyn", "Ex", "Fx"]
+
+
+def opcode_family(opcode):
+    """
+    Label of the opcode in the dataset's naming, e.g. 8xy4, Fx1E or 00E0.
+    """
+    if isinstance(opcode, str):
+        opcode = int(opcode, 16)
+    family = FAMILIES[opcode >> 12]
+    if opcode in (0x00E0, 0x00EE):
+        return f"{opcode:04X}"
+    if family == "8xy":
+        return f"8xy{opcode & 0xF:X}"
+    if family in ("Ex", "Fx"):
+        return f"{family}{opcode & 0xFF:02X}"
+    return family
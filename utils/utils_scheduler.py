@@ -0,0 +1,376 @@
+import multiprocessing
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils.utils_llm import LLMBackend, LLMError
+from utils.utils_metrics import percentile
+
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Hands out `rate` units per second on average with bursts of up to `capacity` units. A rate of None is
+    unlimited.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate or 0.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """
+        Block until `amount` units are available and take them. Returns the time spent waiting.
+        """
+        if self.rate is None:
+            return 0.0
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def debit(self, amount):
+        if self.rate is None:
+            return
+        with self.lock:
+            self.refill()
+            self.tokens -= amount
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    A token bucket kept in shared memory, so that worker processes it is handed to draw from one budget.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate or 0.0)
+        self.state = multiprocessing.Array("d", [self.capacity, time.monotonic()])
+        self.lock = self.state.get_lock()
+
+    @property
+    def tokens(self):
+        return self.state[0]
+
+    @tokens.setter
+    def tokens(self, value):
+        self.state[0] = value
+
+    @property
+    def updated(self):
+        return self.state[1]
+
+    @updated.setter
+    def updated(self, value):
+        self.state[1] = value
+
+
+class ScheduledBackend(LLMBackend):
+    """
+    Wraps a backend with request and token budgets, retries with jittered exponential backoff (or the server's
+    Retry-After) and a concurrency limit that grows by one per window of successes and halves on errors. Budgets
+    shared with other processes are passed in as `request_bucket` and `token_bucket`.
+    """
+
+    def __init__(self, backend, requests_per_minute=None, tokens_per_minute=None, max_concurrency=16,
+                 min_concurrency=1, max_retries=6, base_delay=0.5, max_delay=30.0, decrease_interval=1.0,
+                 request_bucket=None, token_bucket=None, metrics=None):
+        self.backend = backend
+        self.metrics = metrics
+        self.model = backend.model
+        self.requests = request_bucket or TokenBucket(requests_per_minute / 60 if requests_per_minute else None)
+        self.tokens = token_bucket or TokenBucket(tokens_per_minute / 60 if tokens_per_minute else None)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.decrease_interval = decrease_interval
+        self.random = random.Random()
+
+        self.condition = threading.Condition()
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.paused_until = 0.0
+        self.decreased_at = 0.0
+
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.errors = 0
+        self.failures = 0
+        self.budget_wait = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def chat(self, prompt, temperature=0):
+        estimate = len(prompt) // 4
+        attempt = 0
+        while True:
+            self.enter()
+            try:
+                waited = self.requests.acquire() + self.tokens.acquire(estimate)
+                start = time.perf_counter()
+                response = self.backend.chat(prompt, temperature)
+            except LLMError as e:
+                if self.metrics is not None:
+                    self.metrics.record_call(time.perf_counter() - start, error=e, attempt=attempt)
+                delay = self.failed(e, attempt)
+                if delay is None:
+                    raise
+            else:
+                if self.metrics is not None:
+                    self.metrics.record_call(time.perf_counter() - start, response, attempt=attempt)
+                self.succeeded(waited, response)
+                self.tokens.debit(response.prompt_tokens + response.completion_tokens - estimate)
+                return response
+            finally:
+                self.leave()
+            time.sleep(delay)
+            attempt += 1
+
+    def enter(self):
+        with self.condition:
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+            while self.in_flight >= int(self.concurrency) or time.monotonic() < self.paused_until:
+                pause = self.paused_until - time.monotonic()
+                self.condition.wait(pause if pause > 0 else None)
+            self.waiting -= 1
+            self.in_flight += 1
+
+    def leave(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def succeeded(self, waited, response):
+        with self.condition:
+            self.calls += 1
+            self.budget_wait += waited
+            self.prompt_tokens += response.prompt_tokens
+            self.completion_tokens += response.completion_tokens
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    def failed(self, error, attempt):
+        """
+        Record a failed call and return how long to wait before retrying it, or None to give up.
+        """
+        with self.condition:
+            retryable = error.status is None or error.status in RETRYABLE_STATUSES
+            if error.status == 429:
+                self.throttled += 1
+            elif retryable:
+                self.errors += 1
+            if not retryable or attempt >= self.max_retries:
+                self.failures += 1
+                return None
+            self.retries += 1
+
+            now = time.monotonic()
+            if now - self.decreased_at >= self.decrease_interval:
+                self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                self.decreased_at = now
+
+            if error.retry_after is not None:
+                self.paused_until = max(self.paused_until, now + error.retry_after)
+                return error.retry_after
+            return self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def stats(self):
+        with self.condition:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "errors": self.errors,
+                "failures": self.failures,
+                "queue_depth": self.waiting,
+                "peak_queue_depth": self.peak_waiting,
+                "in_flight": self.in_flight,
+                "concurrency": int(self.concurrency),
+                "budget_wait": round(self.budget_wait, 3),
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
+
+    def close(self):
+        self.backend.close()
+
+
+class HedgedBackend(LLMBackend):
+    """
+    Sends a duplicate of any request still running after the `percentile` latency of recent requests and returns
+    whichever copy answers first. At most `budget` hedges are sent per request. A duplicate that has not started
+    yet is cancelled, one already sent is left to finish and its answer discarded.
+    """
+
+    def __init__(self, backend, percentile=95, budget=0.1, min_samples=20, window=200, max_workers=64):
+        self.backend = backend
+        self.model = backend.model
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def hedge_delay(self):
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            return percentile(list(self.latencies), self.percentile)
+
+    def submit(self, prompt, temperature):
+        start = time.monotonic()
+        future = self.executor.submit(self.backend.chat, prompt, temperature)
+        future.add_done_callback(lambda f: self.record(f, start))
+        return future
+
+    def record(self, future, start):
+        if not future.cancelled() and future.exception() is None:
+            with self.lock:
+                self.latencies.append(time.monotonic() - start)
+
+    def chat(self, prompt, temperature=0):
+        with self.lock:
+            self.requests += 1
+        delay = self.hedge_delay()
+        primary = self.submit(prompt, temperature)
+        pending = {primary}
+
+        if delay is not None:
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                with self.lock:
+                    allowed = self.hedges < self.budget * self.requests
+                    if allowed:
+                        self.hedges += 1
+                if allowed:
+                    pending.add(self.submit(prompt, temperature))
+
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                for loser in pending:
+                    loser.cancel()
+                if future is not primary:
+                    with self.lock:
+                        self.hedge_wins += 1
+                return future.result()
+        raise error
+
+    def stats(self):
+        stats = self.backend.stats() if hasattr(self.backend, "stats") else {}
+        delay = self.hedge_delay()
+        with self.lock:
+            stats.update({
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedge_delay": round(delay, 3) if delay is not None else None,
+            })
+        return stats
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.backend.close()
+
+
+class CascadeBackend(LLMBackend):
+    """
+    Sends each request to the first of `tiers`, e.g. a small fine-tune, and escalates to the next tier when the call
+    fails or `accept(prompt, content)` rejects the answer. The last tier's answer is returned whatever it is.
+    """
+
+    def __init__(self, tiers, accept=None):
+        self.tiers = tiers
+        self.accept = accept
+        self.model = ">".join(tier.model for tier in tiers)
+        self.lock = threading.Lock()
+        self.counts = [{"requests": 0, "accepted": 0, "rejected": 0, "errors": 0, "prompt_tokens": 0,
+                        "completion_tokens": 0} for _ in tiers]
+        self.latencies = [[] for _ in tiers]
+
+    def chat(self, prompt, temperature=0):
+        for index, tier in enumerate(self.tiers):
+            last = index == len(self.tiers) - 1
+            start = time.perf_counter()
+            try:
+                response = tier.chat(prompt, temperature)
+            except LLMError:
+                self.record(index, "errors", time.perf_counter() - start)
+                if last:
+                    raise
+                continue
+            latency = time.perf_counter() - start
+            accepted = self.accept is None or self.accept(prompt, response.content)
+            self.record(index, "accepted" if accepted else "rejected", latency, response)
+            if accepted or last:
+                return response
+
+    def record(self, index, outcome, latency, response=None):
+        with self.lock:
+            counts = self.counts[index]
+            counts["requests"] += 1
+            counts[outcome] += 1
+            if response is not None:
+                self.latencies[index].append(latency)
+                counts["prompt_tokens"] += response.prompt_tokens
+                counts["completion_tokens"] += response.completion_tokens
+
+    def tier_stats(self):
+        """
+        Per tier: requests, answers accepted and rejected, failed calls, the share of requests it settled, latency
+        percentiles and tokens.
+        """
+        with self.lock:
+            return [dict(counts, model=tier.model,
+                         hit_rate=round(counts["accepted"] / counts["requests"], 3) if counts["requests"] else 0.0,
+                         latency_p50_seconds=round(percentile(latencies, 50), 4),
+                         latency_p95_seconds=round(percentile(latencies, 95), 4))
+                    for tier, counts, latencies in zip(self.tiers, self.counts, self.latencies)]
+
+    def stats(self):
+        # Counters are summed over the tiers, gauges take the largest tier's value
+        stats = {}
+        for tier in self.tiers:
+            for key, value in (tier.stats() if hasattr(tier, "stats") else {}).items():
+                if value is None:
+                    stats.setdefault(key, None)
+                elif key in ("peak_queue_depth", "concurrency", "hedge_delay"):
+                    stats[key] = max(stats.get(key) or 0, value)
+                else:
+                    stats[key] = stats.get(key, 0) + value
+        stats["tiers"] = self.tier_stats()
+        return stats
+
+    def close(self):
+        for tier in self.tiers:
+            tier.close()
@@ -0,0 +1,70 @@
+import datetime
+import hashlib
+import json
+import os
+import shutil
+from urllib.parse import quote
+
+from utils.utils_disassembly import index_path
+
+DEFAULT_STORE_PATH = os.path.join("~", ".cache", "chipstral", "store")
+
+
+def rom_hash(rom_path):
+    with open(rom_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def copy_file(source, destination):
+    # Unique per process, as workers of a batch may store copies of the same ROM at once
+    temp_path = f"{destination}.{os.getpid()}.tmp"
+    shutil.copyfile(source, temp_path)
+    os.replace(temp_path, destination)
+
+
+class DisassemblyStore:
+    """
+    Finished disassemblies as plain files under `<root>/<ROM hash>/<model>-<prompt version>.chs`, next to their
+    index and a `.json` of metadata. The metadata is written last, so an entry without it is incomplete and ignored.
+    Stores can be merged between machines by copying the directories.
+    """
+
+    def __init__(self, path=None):
+        self.root = os.path.expanduser(path or os.environ.get("CHIPSTRAL_STORE", DEFAULT_STORE_PATH))
+
+    def entry_path(self, digest, model, prompt_version, llm_only=False):
+        name = f"{quote(model, safe='')}-{prompt_version}{'-llm-only' if llm_only else ''}"
+        return os.path.join(self.root, digest, name)
+
+    def get(self, digest, model, prompt_version, llm_only=False):
+        """
+        Return the metadata of the stored disassembly, or None if there is none.
+        """
+        try:
+            with open(f"{self.entry_path(digest, model, prompt_version, llm_only)}.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def emit(self, digest, model, prompt_version, output_path, llm_only=False):
+        """
+        Copy the stored `.chs` and its index to `output_path`.
+        """
+        path = self.entry_path(digest, model, prompt_version, llm_only)
+        copy_file(f"{path}.chs", output_path)
+        if os.path.exists(index_path(f"{path}.chs")):
+            copy_file(index_path(f"{path}.chs"), index_path(output_path))
+
+    def put(self, digest, model, prompt_version, disassembly_path, metadata, llm_only=False):
+        path = self.entry_path(digest, model, prompt_version, llm_only)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        copy_file(disassembly_path, f"{path}.chs")
+        if os.path.exists(index_path(disassembly_path)):
+            copy_file(index_path(disassembly_path), index_path(f"{path}.chs"))
+
+        metadata = dict(metadata, rom_hash=digest, model=model, prompt_version=prompt_version, llm_only=llm_only,
+                        created=datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"))
+        temp_path = f"{path}.json.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(temp_path, f"{path}.json")
@@ -0,0 +1,131 @@
+import re
+import threading
+import zlib
+
+from utils.utils_cache import denormalize_response, normalize_response
+from utils.utils_rules import opcode_fields
+
+# Longest operands first, so that x or n are not matched inside a kk or nnn
+FIELD_ORDER = ("nnn", "kk", "x", "y", "n")
+FIELD_NIBBLES = {"nnn": 0x0FFF, "kk": 0x00FF, "x": 0x0F00, "y": 0x00F0, "n": 0x000F}
+DEFAULT_SPOT_CHECK_INTERVAL = 20
+
+
+def field_pattern(value):
+    return re.compile(rf"(?<![0-9a-zA-Z_]){re.escape(value)}(?![0-9a-fA-F])")
+
+
+def derive_template(address, opcode, response):
+    """
+    Replace the operands of `opcode` found in the response with placeholders. Returns the template and the mask of
+    the opcode bits it does not depend on, or (None, None) when the response has no decoded instruction.
+    """
+    if not isinstance(response.get("decoded_instruction"), str):
+        return None, None
+
+    fields = opcode_fields(opcode)
+    template = {}
+    operands = 0
+    for key, value in normalize_response(address, opcode, response).items():
+        if isinstance(value, str):
+            value = value.replace("{", "{{").replace("}", "}}")
+            for name in FIELD_ORDER:
+                value, count = field_pattern(fields[name]).subn("{" + name + "}", value)
+                if count:
+                    operands |= FIELD_NIBBLES[name]
+        template[key] = value
+    return template, 0xFFFF & ~operands
+
+
+def apply_template(template, address, opcode):
+    fields = opcode_fields(opcode)
+    response = {key: value.format(**fields) if isinstance(value, str) else value for key, value in template.items()}
+    return denormalize_response(address, response)
+
+
+def differs_in_operands(opcode, other, mask):
+    """
+    True when the two opcodes differ in every operand nibble. Only such a pair tells apart templates that read the
+    same text differently, e.g. `{kk}` and `{nnn}` when x is 0.
+    """
+    return all((opcode ^ other) >> shift & 0xF for shift in (0, 4, 8, 12) if ~mask >> shift & 0xF)
+
+
+class OpcodeTemplate:
+    def __init__(self, template, mask, opcode):
+        self.template = template
+        self.mask = mask
+        self.opcode = opcode
+        self.confirmed = False
+
+
+class TemplateCache:
+    """
+    Decode templates learned from LLM responses, one per opcode family. A family is the opcode bits that are not
+    operands in the response, e.g. 0x6000 under the mask 0xF000 for `V[{x}] = {kk}`. A template is only used once a
+    response for a second opcode of the family, with different operands, matched it, and every `spot_check_interval`th
+    decode it would serve is sent to the LLM instead to check it still matches.
+    """
+
+    def __init__(self, spot_check_interval=DEFAULT_SPOT_CHECK_INTERVAL):
+        self.spot_check_interval = spot_check_interval
+        self.templates = {}
+        self.masks = set()
+        self.lock = threading.Lock()
+        self.decodes = 0
+        self.spot_checks = 0
+        self.confirmations = 0
+        self.rejections = 0
+
+    def find(self, opcode):
+        for mask in sorted(self.masks, key=lambda mask: bin(mask).count("1"), reverse=True):
+            template = self.templates.get((mask, opcode & mask))
+            if template is not None:
+                return template
+        return None
+
+    def spot_check_due(self, address, opcode_hex):
+        return zlib.crc32(f"{address}:{opcode_hex}".encode()) % self.spot_check_interval == 0
+
+    def lookup(self, address, opcode_hex):
+        opcode = int(opcode_hex, 16)
+        with self.lock:
+            template = self.find(opcode)
+            if template is None or not template.confirmed:
+                return None
+            if self.spot_check_interval and self.spot_check_due(address, opcode_hex):
+                self.spot_checks += 1
+                return None
+            self.decodes += 1
+            return apply_template(template.template, address, opcode)
+
+    def covers(self, address, opcode_hex):
+        """
+        Whether `lookup` would decode the opcode, without counting a decode or spot check.
+        """
+        with self.lock:
+            template = self.find(int(opcode_hex, 16))
+            return template is not None and template.confirmed and \
+                not (self.spot_check_interval and self.spot_check_due(address, opcode_hex))
+
+    def learn(self, address, opcode_hex, response):
+        """
+        Check an LLM response against the template of its family, confirming or replacing the template.
+        """
+        opcode = int(opcode_hex, 16)
+        with self.lock:
+            template = self.find(opcode)
+            if template is not None and template.opcode != opcode:
+                if apply_template(template.template, address, opcode) == response:
+                    if not template.confirmed and differs_in_operands(opcode, template.opcode, template.mask):
+                        template.confirmed = True
+                        self.confirmations += 1
+                    return
+                if template.confirmed:
+                    self.rejections += 1
+                del self.templates[(template.mask, template.opcode & template.mask)]
+
+            derived, mask = derive_template(address, opcode, response)
+            if derived is not None and (mask, opcode & mask) not in self.templates:
+                self.templates[(mask, opcode & mask)] = OpcodeTemplate(derived, mask, opcode)
+                self.masks.add(mask)
@@ -0,0 +1,156 @@
+import ast
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from code_executor import CodeExecutor
+from cpu import CPU
+from display import Display
+from memory import Memory
+from utils.utils_rules import decode_with_rules
+
+DEFAULT_STATES = 8
+
+
+def boundary_states(opcode):
+    """
+    Register overrides at the edges of 8-bit arithmetic for the operands of `opcode`, as (V overrides, I): wrapping
+    additions and borrowing subtractions, shifted-out bits, equal and different operands, and I near the end of
+    memory. VF is preset to 0 or 1 first, so when x or y is 0xF the operand itself is the flag.
+    """
+    x, y, kk = opcode >> 8 & 0xF, opcode >> 4 & 0xF, opcode & 0xFF
+    return [
+        ({0xF: 0, x: 0xFF, y: 0x01}, None),
+        ({0xF: 1, x: 0x00, y: 0x01}, None),
+        ({0xF: 0, x: 0x100 - kk if kk else 0x80, y: 0xFF}, None),
+        ({0xF: 1, x: 0xF0, y: 0x20}, 0xFF0),
+        ({0xF: 0, x: 0x20, y: 0xF0}, None),
+        ({0xF: 1, x: 0x81, y: 0x81}, None),
+        ({0xF: 0, x: 0x42, y: 0x42}, 0xFF0),
+        ({0xF: 1, x: 0x01, y: 0x80}, None),
+    ]
+
+
+def random_cpu(rng, address, opcode, registers=None, index=None):
+    """
+    A CPU in a random state, as it would be right after fetching `opcode` from `address`. Every other state sets
+    V[x] to kk and V[y] to V[x], so that skips and comparisons take both branches. `registers` and `index` then
+    override V and I, for the boundary states.
+    """
+    memory = Memory(list(rng.randbytes(4096)))
+    bits = rng.getrandbits(64 * 32)
+    display = Display([[bits >> (row * 64 + column) & 1 for column in range(64)] for row in range(32)])
+    cpu = CPU(memory, display)
+    cpu.V = [rng.randrange(256) if rng.random() < 0.5 else rng.randrange(16) for _ in range(16)]
+    cpu.I = rng.randrange(0x1000 - 0x20)
+    cpu.PC = address + 2
+    cpu.stack = [0x200 + 2 * rng.randrange(0x700) for _ in range(rng.randrange(4))]
+    cpu.DT = rng.randrange(256)
+    cpu.ST = rng.randrange(256)
+    cpu.keys = [rng.randrange(2) for _ in range(16)]
+    if rng.random() < 0.5:
+        x, y, kk = opcode >> 8 & 0xF, opcode >> 4 & 0xF, opcode & 0xFF
+        cpu.V[x] = kk
+        cpu.V[y] = cpu.V[x]
+    for register, value in (registers or {}).items():
+        cpu.V[register] = value
+    if index is not None:
+        cpu.I = index
+    return cpu
+
+
+def cpu_state(cpu):
+    return (list(cpu.V), cpu.I, cpu.PC, cpu.DT, cpu.ST, list(cpu.stack), list(cpu.memory.memory),
+            [list(row) for row in cpu.display.pixels], cpu.waiting_keypress, cpu.keypress_register)
+
+
+def run_in_sandbox(code, seed, address, opcode, registers=None, index=None):
+    """
+    Execute `code` on the random state drawn from `seed`. Returns the state afterwards, or None if it raised.
+    """
+    cpu = random_cpu(random.Random(seed), address, opcode, registers, index)
+    executor = CodeExecutor(cpu, rng=random.Random(seed), verbose=False)
+    executor.execute_code(code)
+    if executor.error_count:
+        return None
+    return cpu_state(cpu)
+
+
+def validate_decode(address, opcode_hex, response, states=DEFAULT_STATES):
+    """
+    Check a decode by executing it on the boundary states and `states` random CPU states. Standard opcodes must
+    leave every state exactly as the rule decoder's code does, other opcodes only have to compile and run. Returns
+    None when the decode passes, or the reason it failed.
+    """
+    code = response.get("decoded_instruction")
+    if not isinstance(code, str):
+        return "no decoded instruction"
+    try:
+        compile(ast.parse(code, mode='exec'), filename="<ast>", mode="exec")
+    except SyntaxError as e:
+        return f"syntax error: {e.msg}"
+
+    opcode = int(opcode_hex, 16)
+    reference = decode_with_rules(address, opcode)
+    reference_code = reference["decoded_instruction"] if reference is not None else None
+    if reference_code == code:
+        return None
+
+    cases = boundary_states(opcode) + [(None, None)] * states
+    for case, (registers, index) in enumerate(cases):
+        seed = opcode << 20 | address << 8 | case
+        expected = run_in_sandbox(reference_code, seed, address, opcode, registers, index) \
+            if reference_code is not None else None
+        if reference_code is not None and expected is None:
+            # The state is invalid for this opcode, e.g. a key index above 0xF
+            continue
+        actual = run_in_sandbox(code, seed, address, opcode, registers, index)
+        if actual is None:
+            return "raised an exception"
+        if expected is not None and actual != expected:
+            return "differs from the reference"
+    return None
+
+
+class DecodeValidator:
+    """
+    Validates decodes on a thread pool, so that the walk never waits for it. `failures` collects the decodes that
+    did not pass, and the reason, by address.
+    """
+
+    def __init__(self, states=DEFAULT_STATES, workers=4):
+        self.states = states
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.validated = 0
+        self.failed = 0
+
+    def submit(self, address, opcode_hex, response):
+        future = self.executor.submit(validate_decode, address, opcode_hex, response, self.states)
+        with self.lock:
+            self.pending[address] = (opcode_hex, response, future)
+
+    def check(self, address, opcode_hex, response):
+        return validate_decode(address, opcode_hex, response, self.states)
+
+    def failures(self):
+        """
+        Wait for the pending validations and return {address: (opcode_hex, response, reason)} of those that failed.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+
+        failures = {}
+        for address, (opcode_hex, response, future) in pending.items():
+            reason = future.result()
+            with self.lock:
+                self.validated += 1
+                if reason is not None:
+                    self.failed += 1
+            if reason is not None:
+                failures[address] = (opcode_hex, response, reason)
+        return failures
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)